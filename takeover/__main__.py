@@ -1,4 +1,6 @@
 
 from takeover.takeover import main
 
-main()
+# Guarded: worker processes (see worker) import the main module again
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,393 @@
+
+import numpy as np
+
+# if run as a script, pull from local directory
+# otherwise (if run as module), pull from package
+if __package__:
+    from . import gamelogic
+else:
+    import gamelogic
+
+# A drop-in replacement for gamelogic.Game for large galaxies, requiring
+# numpy. The game state is kept as a struct of arrays, rather than as
+# Player, Planet, and Fleet objects:
+# - planets: position, ships, production, strength, owner (-1: neutral)
+# - fleets: position, velocity, ships, strength, owner, src, dst, turn of
+#   arrival (known at launch, see gamelogic.course()), sequence number.
+#   Fleets live in slots; a freed slot is reused by later fleets. Free
+#   slots have zero velocity, so that all slots can be moved at once.
+#
+# Production, fleet movement, and arrival detection are vectorized. Battles
+# and AI moves are still done one at a time (they depend on each other).
+#
+# The UI (and any Observer) sees the familiar object interface through thin
+# views: PlanetView, PlayerView, FleetView read from, and write to, the
+# arrays of the game. Views do not hold state of their own.
+
+class PlanetView:
+    def __init__( self, game, idx ):
+        self.game = game
+        self.idx = idx
+
+    @property
+    def name( self ):
+        return self.game.names[ self.idx ]
+
+    @name.setter
+    def name( self, name ):
+        self.game.names[ self.idx ] = name
+
+    @property
+    def pos( self ):
+        x, y = self.game.planet_pos[ self.idx ]
+        return ( float(x), float(y) )
+
+    @property
+    def ships( self ):
+        return int( self.game.ships[ self.idx ] )
+
+    @property
+    def prod( self ):
+        return int( self.game.prod[ self.idx ] )
+
+    @property
+    def strength( self ):
+        return float( self.game.strength[ self.idx ] )
+
+    @property
+    def owner( self ):
+        owner = self.game.owner[ self.idx ]
+        return self.game.players[ owner ] if owner >= 0 else None
+
+    def stats( self ):
+        owner = self.owner.name if self.owner else " "
+        return [ " "+self.name, owner, "%d" % self.ships, "%d" % self.prod,
+                 "%.2f" % self.strength, "%.2f" % (self.prod*self.strength) ]
+
+
+class PlayerView:
+    def __init__( self, game, idx, name, is_human ):
+        self.game = game
+        self.idx = idx
+        self.name = name
+        self.is_human_ = is_human
+
+        # AI parameters, and strategy, as for gamelogic.Player
+        self.ratio = 0.7
+        self.threshold = ( 15, 50 )
+        self.strategy = None
+
+    def is_human( self ):
+        return self.is_human_
+
+    def is_active( self ):
+        return self.game.active()[ self.idx ]
+
+    # In the order they were acquired, as for gamelogic.Player
+    @property
+    def planets( self ):
+        idx = self.game.owned( self.idx )
+        return [ self.game.planets[i] for i in idx ]
+
+    @property
+    def fleets( self ):
+        g = self.game
+        idx = np.flatnonzero( g.alive & (g.fleet_owner == self.idx) )
+        return [ g.fleets[i] for i in idx ]
+
+    # src and dst are PlanetViews, as for gamelogic.Player
+    def launch_fleet( self, src, dst, ships ):
+        return self.game.launch( self.idx, src.idx, dst.idx, ships )
+
+    def stats( self ):
+        g = self.game
+        mine = g.owner == self.idx
+        flt = g.alive & (g.fleet_owner == self.idx)
+
+        planets = int( mine.sum() )
+        ships = g.ships[mine].sum() + g.fleet_ships[flt].sum()
+
+        prod, strength = 0, 0
+        if planets > 0:
+            prod = g.prod[mine].sum()
+            strength = g.strength[mine].mean()
+
+        power = ( g.ships[mine]*g.strength[mine] ).sum()
+        power += ( g.fleet_ships[flt]*g.fleet_strength[flt] ).sum()
+
+        return [ " " + self.name, planets, "%d" % ships,
+                 "%d" % round( power, 6 ), "%d" % prod,
+                 "%.2f" % strength ]
+
+
+class FleetView:
+    def __init__( self, game, slot ):
+        self.game = game
+        self.slot = slot
+
+        # Fixed for the lifetime of the fleet
+        self.owner = game.players[ game.fleet_owner[slot] ]
+        self.src = game.planets[ game.fleet_src[slot] ]
+        self.dst = game.planets[ game.fleet_dst[slot] ]
+        self.strength = float( game.fleet_strength[slot] )
+
+    @property
+    def ships( self ):
+        return int( self.game.fleet_ships[ self.slot ] )
+
+    @property
+    def pos( self ):
+        x, y = self.game.fleet_pos[ self.slot ]
+        return ( float(x), float(y) )
+
+    @property
+    def velocity( self ):
+        x, y = self.game.fleet_vel[ self.slot ]
+        return ( float(x), float(y) )
+
+    def __str__( self ):
+        return "%s : %d : %s -> %s" % ( self.owner.name, self.ships,
+                                        self.src.name, self.dst.name )
+
+
+class ArrayGame:
+    def __init__( self, players, planets, positions, seed=None,
+                  battle="sampled", observer=None, autopilot=False,
+                  neighbors=None, radius=None, dtype="float64",
+                  capacity=64 ):
+        self.streams = gamelogic.Streams( seed )
+        self.seed = self.streams.seed
+        self.battle = gamelogic.BATTLES[ battle ]
+        self.observer = observer or gamelogic.Observer()
+        self.autopilot = autopilot
+
+        # Same draws as gamelogic.Game: the same seed gives the same galaxy
+        rng = self.streams.map
+        positions = list( positions )
+        rng.shuffle( positions )
+
+        homes = 1 + players
+        n = homes + planets
+
+        self.planet_pos = np.array( positions[:n], dtype=float )
+        self.ships = np.empty( n, dtype=np.int64 )
+        self.prod = np.empty( n, dtype=np.int64 )
+        self.strength = np.empty( n )
+        self.owner = np.full( n, -1, dtype=np.int32 )
+
+        self.prod[:homes] = 10
+        self.strength[:homes] = 0.4
+        self.owner[:homes] = np.arange( homes )
+        for i in range( homes, n ):
+            self.prod[i] = rng.randint( 5, 15 )
+            self.strength[i] = rng.uniform( 0.1, 1.0 )
+        self.ships[:] = self.prod
+
+        # Order in which the planets were acquired by their current owners:
+        # players' planets are taken in that order, as for gamelogic.Player
+        self.acquired = np.arange( n, dtype=np.int64 )
+        self.acquisitions = n
+
+        # Neighbors of each planet, nearest first (including itself)
+        self.distances = gamelogic.neighbor_index( self.planet_pos, None,
+                                                   neighbors, radius, dtype )
+
+        self.names = [ "P%02d" % i for i in range( n ) ]
+        self.planets = [ PlanetView( self, i ) for i in range( n ) ]
+
+        self.players = [ PlayerView( self, 0, "human", True ) ]
+        for i in range( players ):
+            self.players.append( PlayerView( self, 1+i, "AI%0d" % i, False ) )
+
+        # Fleet slots
+        self.fleet_pos = np.zeros( (capacity, 2) )
+        self.fleet_vel = np.zeros( (capacity, 2) )
+        self.fleet_arrival = np.zeros( capacity, dtype=np.int64 )
+        self.fleet_ships = np.zeros( capacity, dtype=np.int64 )
+        self.fleet_strength = np.zeros( capacity )
+        self.fleet_owner = np.full( capacity, -1, dtype=np.int32 )
+        self.fleet_src = np.zeros( capacity, dtype=np.int32 )
+        self.fleet_dst = np.zeros( capacity, dtype=np.int32 )
+        self.fleet_seq = np.zeros( capacity, dtype=np.int64 )
+        self.alive = np.zeros( capacity, dtype=bool )
+
+        self.fleets = [ None ]*capacity   # FleetView per live slot
+        self.free = list( range( capacity-1, -1, -1 ) )
+        self.seq = 0
+        self.turn = 0
+
+        self.observer.game_started( self )
+
+    def grow( self ):
+        old = len( self.alive )
+        new = 2*old
+
+        for name in [ "fleet_pos", "fleet_vel", "fleet_arrival",
+                      "fleet_ships", "fleet_strength", "fleet_owner",
+                      "fleet_src", "fleet_dst", "fleet_seq", "alive" ]:
+            arr = getattr( self, name )
+            grown = np.zeros( (new,) + arr.shape[1:], dtype=arr.dtype )
+            grown[:old] = arr
+            setattr( self, name, grown )
+        self.fleet_owner[old:] = -1
+
+        self.fleets.extend( [ None ]*old )
+        self.free.extend( range( new-1, old-1, -1 ) )
+
+    def active( self ):
+        count = np.bincount( self.owner[ self.owner >= 0 ],
+                             minlength=len(self.players) )
+        count += np.bincount( self.fleet_owner[ self.alive ],
+                              minlength=len(self.players) )
+        return count > 0
+
+    # Indices of the player's planets, in the order they were acquired
+    def owned( self, player ):
+        idx = np.flatnonzero( self.owner == player )
+        return idx[ np.argsort( self.acquired[idx] ) ]
+
+    def launch( self, player, src, dst, ships ):
+        if not self.free:
+            self.grow()
+        k = self.free.pop()
+
+        vel, turns = gamelogic.course( self.planet_pos[src].tolist(),
+                                       self.planet_pos[dst].tolist() )
+
+        self.fleet_vel[k] = vel
+        # Make an initial step in direction; to get away from planet
+        self.fleet_pos[k] = self.planet_pos[src] + 1.75*self.fleet_vel[k]
+        self.fleet_ships[k] = ships
+        self.fleet_strength[k] = self.strength[src]
+        self.fleet_owner[k] = player
+        self.fleet_src[k] = src
+        self.fleet_dst[k] = dst
+        self.fleet_arrival[k] = self.turn + turns
+        self.fleet_seq[k] = self.seq
+        self.alive[k] = True
+        self.seq += 1
+
+        self.ships[src] -= ships   # very important!
+
+        fleet = FleetView( self, k )
+        self.fleets[k] = fleet
+        self.observer.fleet_launched( fleet )
+        return fleet
+
+    def land( self, k ):
+        dst = self.fleet_dst[k]
+        ships = int( self.fleet_ships[k] )
+
+        # Friendly landing
+        if self.fleet_owner[k] == self.owner[dst]:
+            self.ships[dst] += ships
+            return True
+
+        attack, defense = self.battle( ships, int( self.ships[dst] ),
+                                       float( self.fleet_strength[k] ),
+                                       float( self.strength[dst] ),
+                                       self.streams.combat )
+        if attack == 0:
+            self.ships[dst] = defense
+        else:
+            self.owner[dst] = self.fleet_owner[k]
+            self.ships[dst] = attack
+            self.acquired[dst] = self.acquisitions
+            self.acquisitions += 1
+        return False
+
+    # Same moves as gamelogic.Player.make_move(), in the same order (planets
+    # by acquisition, see owned()), unless the player has a strategy (see
+    # strategies)
+    def make_move( self, i ):
+        player = self.players[i]
+        if player.strategy is not None:
+            player.strategy.make_move( player, self.planets )
+            return
+
+        ratio, threshold = player.ratio, player.threshold
+        randint = self.streams.ai.randint
+
+        owner = self.owner.tolist()
+        ships = self.ships.tolist()
+        targets = set( self.fleet_dst[ self.alive &
+                                       (self.fleet_owner == i) ].tolist() )
+
+        for p in self.owned( i ).tolist():
+            for q in self.distances.neighbors( p ):
+                if p == q or owner[q] == i:
+                    continue
+
+                # Threshold can't be met any more: no need to draw
+                if ratio*ships[p] < threshold[0]:
+                    break
+                if ratio*ships[p] < randint( *threshold ):
+                    continue
+
+                if q in targets:
+                    continue
+
+                if ships[q] < ratio*ships[p]:
+                    n = int( ratio*ships[p] )
+                    self.launch( i, p, q, n )
+                    ships[p] -= n
+                    targets.add( q )
+
+    def propagate( self ):
+        # Production
+        self.ships += self.prod*( self.owner >= 0 )
+
+        shuffled_players = list( range( len(self.players) ) )
+        self.streams.combat.shuffle( shuffled_players )
+
+        # Movement and arrivals (by turn, as for gamelogic.Schedule)
+        self.turn += 1
+        self.fleet_pos += self.fleet_vel
+        arrived = self.alive & ( self.fleet_arrival <= self.turn )
+
+        # Arrivals are resolved in (shuffled) player order, then launch order
+        rank = np.empty( len(self.players), dtype=np.int64 )
+        rank[ shuffled_players ] = np.arange( len(self.players) )
+
+        slots = np.flatnonzero( arrived )
+        slots = slots[ np.lexsort( ( self.fleet_seq[slots],
+                                     rank[ self.fleet_owner[slots] ] ) ) ]
+
+        for k in slots.tolist():
+            fleet = self.fleets[k]
+            is_support = self.land( k )
+
+            self.alive[k] = False
+            self.fleet_owner[k] = -1
+            self.fleet_vel[k] = 0.0
+            self.fleets[k] = None
+            self.free.append( k )
+
+            self.observer.fleet_arrived( fleet, is_support )
+
+        active = self.active()
+        for i in shuffled_players:
+            if not active[i]:
+                continue
+            if self.autopilot or not self.players[i].is_human():
+                self.make_move( i )
+
+        self.observer.turn_finished( self )
+
+        # check for game over
+        return int( self.active().sum() )
+
+    # Used to activate slider
+    def is_owned_by_human( self, idx ):
+        return self.owner[idx] == 0
+
+    # Used to populate slider
+    def ships_on_planet( self, idx ):
+        return int( self.ships[idx] )
+
+    # Used to launch a fleet from the UI (player is always human!)
+    def launch_fleet( self, src_idx, dst_idx, size ):
+        if size == 0:
+            return
+
+        self.launch( 0, src_idx, dst_idx, size )
@@ -0,0 +1,578 @@
+import argparse
+import concurrent.futures
+import math
+import os
+import random
+import subprocess
+import sys
+import time
+
+# Benchmarks and consistency checks for the game engine. No UI required
+# (except for startup and autoplay, which need a display, or EGL with
+# --headless).
+#
+# Usage:
+#   python -m takeover.bench battles [--trials N] [--seed S]
+#   python -m takeover.bench tournament [--games N] [--workers W] ...
+#   python -m takeover.bench galaxy [--planets N] [--fleets M] ...
+#   python -m takeover.bench ai [--planets N] [--fleets M M ...]
+#   python -m takeover.bench maps [--planets N] [--spacing D] [--seed S]
+#   python -m takeover.bench startup [--runs N] [--target SECS] [--headless]
+#   python -m takeover.bench autoplay [--rate TPS] [--seconds S] [--headless]
+
+if __package__:
+    from . import gamelogic
+    from . import lookahead
+    from . import maps
+    from . import strategies
+else:
+    import gamelogic
+    import lookahead
+    import maps
+    import strategies
+
+
+# ------------------------------------------------------------
+# Battles: check that battle_sampled() reproduces the survivor distribution
+# of battle_exact(), and compare their speed.
+
+# attack, defense, attack strength, defense strength
+SCENARIOS = [ ( 10, 10, 0.5, 0.5 ),
+              ( 30, 12, 0.2, 0.9 ),
+              ( 12, 30, 0.9, 0.2 ),
+              ( 60, 4, 0.3, 0.3 ),
+              ( 100, 80, 0.7, 0.4 ),
+              ( 250, 250, 0.4, 0.4 ) ]
+
+
+# Two-sample chi-square test of homogeneity for two equally sized samples.
+# Outcomes are signed survivor counts (attack > 0, defense < 0). Adjacent
+# outcomes are pooled until each bin holds enough observations.
+# Returns ( statistic, degrees of freedom, p-value ).
+def chi_square( sample1, sample2, min_count=10 ):
+    counts = {}
+    for x in sample1:
+        counts.setdefault( x, [0, 0] )[0] += 1
+    for x in sample2:
+        counts.setdefault( x, [0, 0] )[1] += 1
+
+    bins, crr = [], [0, 0]
+    for x in sorted( counts ):
+        crr[0] += counts[x][0]
+        crr[1] += counts[x][1]
+        if crr[0] + crr[1] >= min_count:
+            bins.append( crr )
+            crr = [0, 0]
+    if crr[0] + crr[1] > 0:
+        if bins:
+            bins[-1][0] += crr[0]
+            bins[-1][1] += crr[1]
+        else:
+            bins.append( crr )
+
+    stat = sum( (a-b)**2/(a+b) for a, b in bins )
+    df = len(bins) - 1
+    if df < 1:
+        return stat, df, 1.0
+
+    # Wilson-Hilferty approximation to the chi-square tail
+    z = ( (stat/df)**(1/3) - (1 - 2/(9*df)) )/math.sqrt( 2/(9*df) )
+    return stat, df, 0.5*math.erfc( z/math.sqrt(2) )
+
+
+def run_battles( resolver, scenario, trials, rng ):
+    attack, defense, sa, sd = scenario
+
+    sample = []
+    start = time.perf_counter()
+    for _ in range( trials ):
+        a, d = resolver( attack, defense, sa, sd, rng )
+        sample.append( a - d )
+    elapsed = time.perf_counter() - start
+
+    return sample, elapsed
+
+
+def battles( args ):
+    rng = random.Random( args.seed )
+
+    print( "%-24s %8s %8s %8s %6s %8s %10s %10s" %
+           ( "scenario", "win(ex)", "win(sa)", "chi2", "df", "p",
+             "us(ex)", "us(sa)" ) )
+
+    worst = 1.0
+    for scenario in SCENARIOS:
+        exact, t1 = run_battles( gamelogic.battle_exact, scenario,
+                                 args.trials, rng )
+        sampled, t2 = run_battles( gamelogic.battle_sampled, scenario,
+                                   args.trials, rng )
+        stat, df, p = chi_square( exact, sampled )
+        worst = min( worst, p )
+
+        print( "%-24s %8.4f %8.4f %8.1f %6d %8.4f %10.2f %10.2f" %
+               ( "%d:%d @ %.1f:%.1f" % scenario,
+                 sum( x > 0 for x in exact )/args.trials,
+                 sum( x > 0 for x in sampled )/args.trials,
+                 stat, df, p,
+                 1e6*t1/args.trials, 1e6*t2/args.trials ) )
+
+    # Single large battle: the case that motivated the sampled resolver
+    for name in [ "exact", "sampled" ]:
+        start = time.perf_counter()
+        gamelogic.BATTLES[name]( 5000, 5000, 0.5, 0.5, rng )
+        print( "5000:5000 %-8s %10.2f us" %
+               ( name, 1e6*(time.perf_counter() - start) ) )
+
+    # Several scenarios are tested: apply a Bonferroni correction
+    alpha = 0.001
+    ok = worst >= alpha/len(SCENARIOS)
+    print( "distributions %s (smallest p = %.4f)" %
+           ( "match" if ok else "DIFFER", worst ) )
+    return 0 if ok else 1
+
+
+# ------------------------------------------------------------
+# Tournament: AI-only games (the AI also plays the human seat), one game per
+# task, spread across a process pool. Seat 0 (the human seat) can be given
+# its own AI parameters, or a strategy of its own (the lookahead AI with a
+# time budget per turn, for instance), to tune them against the other
+# seats' AI. Each game is played on a map of its own, generated from the
+# game's seed.
+
+# Game class for --backend; arraygame requires numpy, so import on demand
+def game_class( backend ):
+    if backend == "arrays":
+        if __package__:
+            from . import arraygame
+        else:
+            import arraygame
+        return arraygame.ArrayGame
+    return gamelogic.Game
+
+
+# Runs in a worker process; returns a tuple, cheap to send back
+def play_game( task ):
+    (seed, opponents, planets, max_turns, battle, ratio, threshold,
+     backend, neighbors, check, strategy, ai, budget) = task
+
+    options = { "check": True } if check else {}
+    game = game_class( backend )( opponents, planets, maps.board_map( seed ),
+                                  seed=seed, battle=battle, autopilot=True,
+                                  neighbors=neighbors, **options )
+    game.players[0].ratio = ratio
+    game.players[0].threshold = threshold
+    game.players[0].strategy = strategies.make( strategy, game )
+    for p in game.players[1:]:
+        p.strategy = strategies.make( ai, game )
+    if budget:
+        game.players[0].strategy = lookahead.Lookahead( game, budget,
+                                                        seed=seed )
+
+    turns, elapsed, slowest = 0, 0.0, 0.0
+    alive = len( game.players )
+    while alive > 1 and turns < max_turns:
+        start = time.perf_counter()
+        alive = game.propagate()
+        dt = time.perf_counter() - start
+
+        turns += 1
+        elapsed += dt
+        slowest = max( slowest, dt )
+
+    winner = None
+    if alive == 1:
+        winner = [ p.is_active() for p in game.players ].index( True )
+
+    return seed, winner, turns, elapsed, slowest
+
+
+def tournament( args ):
+    if args.backend == "arrays" and args.check:
+        args.parser.error( "--check requires --backend objects" )
+    if args.backend == "arrays" and ( args.lookahead or "lookahead" in
+                                      ( args.strategy, args.ai ) ):
+        args.parser.error( "the lookahead AI requires --backend objects" )
+
+    seed = args.seed if args.seed is not None else random.randrange( 2**32 )
+    tasks = [ ( seed+i, args.opponents, args.planets, args.max_turns,
+                args.battle, args.ratio, tuple(args.threshold),
+                args.backend, args.neighbors, args.check, args.strategy,
+                args.ai, args.lookahead )
+              for i in range( args.games ) ]
+
+    seats = 1 + args.opponents
+    wins = [0]*seats
+    draws, lengths, turns, elapsed, slowest = 0, [], 0, 0.0, 0.0
+
+    workers = args.workers or os.cpu_count() or 1
+    chunk = max( 1, len(tasks)//(8*workers) )
+
+    start = time.perf_counter()
+    with concurrent.futures.ProcessPoolExecutor( workers ) as pool:
+        for _, winner, n, t, worst in pool.map( play_game, tasks,
+                                                chunksize=chunk ):
+            if winner is None:
+                draws += 1
+            else:
+                wins[winner] += 1
+                lengths.append( n )
+            turns += n
+            elapsed += t
+            slowest = max( slowest, worst )
+    wall = time.perf_counter() - start
+
+    print( "%d games (seeds %d..%d), %d opponents, %d neutral planets" %
+           ( args.games, seed, seed+args.games-1,
+             args.opponents, args.planets ) )
+    print( "seat 0: ratio %.2f, threshold %d..%d, %s" %
+           ( args.ratio, *args.threshold, args.strategy ) +
+           ( ", lookahead %g ms" % args.lookahead if args.lookahead else "" ) )
+    print( "other seats: %s" % args.ai )
+    print()
+    for i in range( seats ):
+        print( "%-8s %6d wins %7.2f%%" %
+               ( "human" if i == 0 else "AI%d" % (i-1), wins[i],
+                 100*wins[i]/args.games ) )
+    print( "%-8s %6d      %7.2f%%" % ( "no win", draws,
+                                      100*draws/args.games ) )
+    print()
+    if lengths:
+        lengths.sort()
+        print( "game length: mean %.1f, median %d, max %d turns" %
+               ( sum(lengths)/len(lengths), lengths[len(lengths)//2],
+                 lengths[-1] ) )
+    print( "turn time: mean %.1f us, max %.1f us" %
+           ( 1e6*elapsed/max( turns, 1 ), 1e6*slowest ) )
+    print( "wall time: %.2f s, %.0f games/s, %.0f turns/s" %
+           ( wall, args.games/wall, turns/wall ) )
+    return 0
+
+
+# ------------------------------------------------------------
+# Galaxy: time turns in a large galaxy, with many fleets underway. By
+# default without AI opponents (the human's fleets are the only ones).
+
+def galaxy( args ):
+    rng = random.Random( args.seed )
+    positions = [ ( rng.uniform( 0, args.size ), rng.uniform( 0, args.size ) )
+                  for _ in range( args.planets ) ]
+
+    for backend in args.backend:
+        start = time.perf_counter()
+        game = game_class( backend )( args.opponents,
+                                      args.planets-1-args.opponents,
+                                      positions, seed=args.seed,
+                                      neighbors=args.neighbors )
+        setup = time.perf_counter() - start
+
+        # Fleets of a single ship, between random pairs of planets
+        human = game.players[0]
+        for _ in range( args.fleets ):
+            src = rng.randrange( args.planets )
+            dst = ( src + rng.randrange( 1, args.planets ) )%args.planets
+            if backend == "arrays":
+                game.launch( 0, src, dst, 1 )
+            else:
+                human.launch_fleet( game.planets[src], game.planets[dst], 1 )
+
+        start = time.perf_counter()
+        for _ in range( args.turns ):
+            game.propagate()
+        elapsed = time.perf_counter() - start
+
+        print( "%-8s %d planets, %d fleets: setup %.3f s, %.3f ms/turn" %
+               ( backend, args.planets, args.fleets, setup,
+                 1e3*elapsed/args.turns ) )
+    return 0
+
+
+# ------------------------------------------------------------
+# AI: time a single AI move, with many fleets of its own underway. The AI
+# owns half of the planets, and all others are too strong to attack: so
+# every (planet, neighbor) pair is checked, but nothing is launched. The
+# fleets all head for the same few planets; the other planets must be
+# checked against all of them (unless indexed).
+
+def ai( args ):
+    rng = random.Random( args.seed )
+    positions = [ ( rng.uniform( 0, args.size ), rng.uniform( 0, args.size ) )
+                  for _ in range( args.planets ) ]
+
+    print( "%d planets, %d owned by the AI" %
+           ( args.planets, args.planets//2 ) )
+    for fleets in args.fleets:
+        game = gamelogic.Game( 1, args.planets-2, positions, seed=args.seed,
+                               neighbors=args.neighbors )
+        player = game.players[1]
+        for p in game.planets[:args.planets//2]:
+            p.change_owner( player )
+
+        for _ in range( fleets ):
+            src = rng.choice( game.planets[:args.planets//2] )
+            dst = rng.choice( game.planets[-3:] )
+            src.ships += 1
+            player.launch_fleet( src, dst, 1 )
+
+        for p in game.planets:
+            p.ships = 1000 if p.owner == player else 10**6
+
+        start = time.perf_counter()
+        for _ in range( args.turns ):
+            player.make_move( game.planets )
+        elapsed = time.perf_counter() - start
+
+        print( "%6d fleets: %8.3f ms/move" % ( fleets,
+                                              1e3*elapsed/args.turns ) )
+    return 0
+
+
+# ------------------------------------------------------------
+# Maps: time the map generator, for a square map that should hold the given
+# number of planets, and check the spacing between them. The second call
+# (same seed and parameters) comes from the cache.
+
+def maps_( args ):
+    size = maps.map_size( args.planets, args.spacing )
+    seed = args.seed if args.seed is not None else random.randrange( 2**32 )
+
+    times = []
+    for _ in range( 2 ):
+        start = time.perf_counter()
+        positions = maps.galaxy_map( size, size, args.spacing, seed=seed )
+        times.append( time.perf_counter() - start )
+
+    # Nearest neighbor of each planet (the nearest one is itself)
+    grid = gamelogic.Grid( positions )
+    closest = math.inf
+    for x, y in positions:
+        j = grid.query( x, y, k=2 )[1]
+        closest = min( closest, math.dist( ( x, y ), positions[j] ) )
+
+    print( "%d planets on %.0f x %.0f, spacing %g (seed %d)" %
+           ( len(positions), size, size, args.spacing, seed ) )
+    print( "generated in %.3f s, cached in %.6f s" % tuple( times ) )
+    print( "closest planets: %.3f apart" % closest )
+
+    ok = len( positions ) >= args.planets and closest >= args.spacing
+    return 0 if ok else 1
+
+
+# ------------------------------------------------------------
+# Startup: time a cold start, each in a fresh interpreter, up to the first
+# frame of the splash screen; then until the game assets (loaded in the
+# background) are in, and until the first frame of the game. Times are
+# from the start of the interpreter (as far as Python can tell).
+
+STARTUP = """
+import sys, time
+start = time.perf_counter() - ( time.time() - %(launched)r )
+
+import pyglet
+pyglet.options[ "headless" ] = %(headless)r
+from takeover import takeover, utils
+imported = time.perf_counter()
+
+pyglet.resource.path = [ "@takeover.resources" ]
+win = utils.MainWindow( width=960, height=640, caption="TakeOver" )
+splash = takeover.SplashController( win )
+win.set_controller( splash )
+splash.draw()
+win.flip()
+splash_shown = time.perf_counter()
+
+while not splash.assets.done():
+    pyglet.clock.tick()
+    splash.draw()
+    win.flip()
+loaded = time.perf_counter()
+
+game = takeover.GameController( win, 5, 7, splash.assets )
+game.draw()
+win.flip()
+game_shown = time.perf_counter()
+
+print( imported-start, splash_shown-start, loaded-start, game_shown-start )
+"""
+
+def startup( args ):
+    names = [ "imported", "splash", "loaded", "game" ]
+    print( "%4s" % "run" + "".join( "%10s" % n for n in names ) + "  (secs)" )
+
+    runs = []
+    for i in range( args.runs ):
+        code = STARTUP % { "launched": time.time(),
+                           "headless": args.headless }
+        out = subprocess.run( [ sys.executable, "-c", code ], check=True,
+                              capture_output=True, text=True ).stdout
+        times = [ float( t ) for t in out.split()[-4:] ]
+        runs.append( times )
+        print( "%4d" % i + "".join( "%10.3f" % t for t in times ) )
+
+    best = [ min( col ) for col in zip( *runs ) ]
+    print( "best" + "".join( "%10.3f" % t for t in best ) )
+
+    if best[1] > args.target:
+        print( "Splash screen after %.3f secs: slower than target %.3f" %
+               ( best[1], args.target ) )
+        return 1
+    return 0
+
+
+# ------------------------------------------------------------
+# Autoplay: the whole game, UI included, in auto-play with autopilot (the
+# AI plays all seats), for a number of secs or until the game is over.
+# Reports the turns per sec sustained, and the frames per sec drawn.
+
+def autoplay( args ):
+    import pyglet
+    pyglet.options[ "headless" ] = args.headless
+    if __package__:
+        from . import takeover
+        from . import utils
+    else:
+        import takeover
+        import utils
+
+    pyglet.resource.path = [ "@takeover.resources" ]
+    win = utils.MainWindow( width=960, height=640, caption="TakeOver",
+                            visible=not args.headless )
+    game = takeover.GameController( win, args.opponents, args.planets,
+                                    ai=[ args.ai ]*args.opponents,
+                                    autopilot=True )
+    game.worker.started.result()      # not timing the worker's startup
+    game.rate = args.rate
+    game.start_auto()
+
+    frames = 0
+    draw = game.draw
+    def counted():
+        nonlocal frames
+        frames += 1
+        draw()
+    game.draw = counted
+    win.set_controller( game )
+
+    def check( dt ):
+        if game.over or time.perf_counter() - start > args.seconds:
+            pyglet.app.exit()
+    start = time.perf_counter()
+    pyglet.clock.schedule_interval( check, 0.1 )
+    pyglet.app.run()
+    elapsed = time.perf_counter() - start
+    game.worker.close()
+
+    turns = game.game.schedule.turn
+    print( "%d opponents (%s), %d neutral planets, rate %s" %
+           ( args.opponents, args.ai, args.planets,
+             "%d/s" % args.rate if args.rate else "max" ) )
+    print( "%d turns in %.2f s%s: %.1f turns/s, %d frames, %.1f fps" %
+           ( turns, elapsed, " (game over)" if game.over else "",
+             turns/elapsed, frames, frames/elapsed ) )
+    return 0
+
+
+# ------------------------------------------------------------
+
+def main( argv=None ):
+    parser = argparse.ArgumentParser( prog="python -m takeover.bench" )
+    commands = parser.add_subparsers( dest="command", required=True )
+
+    cmd = commands.add_parser( "battles",
+                               help="compare exact and sampled battles" )
+    cmd.add_argument( "--trials", type=int, default=10000 )
+    cmd.add_argument( "--seed", type=int, default=None )
+    cmd.set_defaults( func=battles )
+
+    cmd = commands.add_parser( "tournament",
+                               help="play many AI-only games in parallel" )
+    cmd.add_argument( "--games", type=int, default=1000 )
+    cmd.add_argument( "--workers", type=int, default=None,
+                      help="worker processes (default: all cores)" )
+    cmd.add_argument( "--opponents", type=int, default=5 )
+    cmd.add_argument( "--planets", type=int, default=7,
+                      help="neutral planets" )
+    cmd.add_argument( "--max-turns", type=int, default=1000 )
+    cmd.add_argument( "--battle", choices=sorted( gamelogic.BATTLES ),
+                      default="sampled" )
+    cmd.add_argument( "--ratio", type=float, default=0.7,
+                      help="AI ratio for seat 0" )
+    cmd.add_argument( "--threshold", type=int, nargs=2, default=[15, 50],
+                      metavar=( "LO", "HI" ), help="AI threshold for seat 0" )
+    cmd.add_argument( "--seed", type=int, default=None,
+                      help="seed of the first game; games use seed+i" )
+    cmd.add_argument( "--backend", choices=[ "objects", "arrays" ],
+                      default="objects" )
+    cmd.add_argument( "--neighbors", type=int, default=None,
+                      help="AI only targets that many nearest planets" )
+    cmd.add_argument( "--check", action="store_true",
+                      help="verify running totals every turn (objects)" )
+    cmd.add_argument( "--strategy", choices=strategies.available(),
+                      default=strategies.BATCHED, help="AI for seat 0" )
+    cmd.add_argument( "--ai", choices=strategies.available(),
+                      default=strategies.BATCHED, help="AI for the other seats" )
+    cmd.add_argument( "--lookahead", type=float, default=0, metavar="MS",
+                      help="seat 0 uses the lookahead AI, with this budget "
+                      "per turn (objects)" )
+    cmd.set_defaults( func=tournament, parser=cmd )
+
+    cmd = commands.add_parser( "galaxy",
+                               help="time turns in a large galaxy" )
+    cmd.add_argument( "--planets", type=int, default=2000 )
+    cmd.add_argument( "--fleets", type=int, default=20000 )
+    cmd.add_argument( "--size", type=float, default=20000.0,
+                      help="width and height of the galaxy" )
+    cmd.add_argument( "--turns", type=int, default=20 )
+    cmd.add_argument( "--opponents", type=int, default=0 )
+    cmd.add_argument( "--neighbors", type=int, default=None,
+                      help="AI only targets that many nearest planets" )
+    cmd.add_argument( "--seed", type=int, default=None )
+    cmd.add_argument( "--backend", nargs="+", choices=[ "objects", "arrays" ],
+                      default=[ "objects", "arrays" ] )
+    cmd.set_defaults( func=galaxy )
+
+    cmd = commands.add_parser( "ai", help="time AI moves vs fleets underway" )
+    cmd.add_argument( "--planets", type=int, default=60 )
+    cmd.add_argument( "--fleets", type=int, nargs="+",
+                      default=[ 0, 100, 500, 2000 ] )
+    cmd.add_argument( "--size", type=float, default=2000.0,
+                      help="width and height of the galaxy" )
+    cmd.add_argument( "--turns", type=int, default=20 )
+    cmd.add_argument( "--neighbors", type=int, default=None,
+                      help="AI only targets that many nearest planets" )
+    cmd.add_argument( "--seed", type=int, default=None )
+    cmd.set_defaults( func=ai )
+
+    cmd = commands.add_parser( "maps", help="time the map generator" )
+    cmd.add_argument( "--planets", type=int, default=10000 )
+    cmd.add_argument( "--spacing", type=float, default=40.0 )
+    cmd.add_argument( "--seed", type=int, default=None )
+    cmd.set_defaults( func=maps_ )
+
+    cmd = commands.add_parser( "startup", help="time a cold start of the UI" )
+    cmd.add_argument( "--runs", type=int, default=5 )
+    cmd.add_argument( "--target", type=float, default=0.5,
+                      help="max secs until the splash screen is shown" )
+    cmd.add_argument( "--headless", action="store_true",
+                      help="no display needed (EGL)" )
+    cmd.set_defaults( func=startup )
+
+    cmd = commands.add_parser( "autoplay",
+                               help="turns per sec of the game, UI included" )
+    cmd.add_argument( "--rate", type=int, default=0,
+                      help="turns per sec (default: 0, as fast as possible)" )
+    cmd.add_argument( "--seconds", type=float, default=10.0 )
+    cmd.add_argument( "--opponents", type=int, default=5 )
+    cmd.add_argument( "--planets", type=int, default=7,
+                      help="neutral planets" )
+    cmd.add_argument( "--ai", choices=strategies.available(),
+                      default=strategies.BATCHED )
+    cmd.add_argument( "--headless", action="store_true",
+                      help="no display needed (EGL)" )
+    cmd.set_defaults( func=autoplay )
+
+    args = parser.parse_args( argv )
+    return args.func( args )
+
+
+if __name__ == "__main__":
+    raise SystemExit( main() )
@@ -1,7 +1,24 @@
 
+import array
+import collections
+import heapq
+import importlib
 import math
 import random
 
+# numpy is optional. It is also slow to import, and only needed once a game
+# is set up: it is imported on first use, see numpy()
+np = None
+
+def numpy():
+    global np
+    if np is None:
+        try:
+            np = importlib.import_module( "numpy" )
+        except ImportError:
+            np = False
+    return np or None
+
 # Players, Planets, Fleets hold objects of each other.
 # Use integer indices only in the interface to the UI.
 #
@@ -9,16 +26,46 @@ import random
 # - At creation, each Player gets a homeplanet.
 # - Thereafter, ownership only changes in battles.
 #
-# Fleet and Player objs hold refs of each other. 
+# Fleet and Player objs hold refs of each other. Like planets, a player's
+# fleets are kept as dict keys: insertion-ordered, with O(1) removal.
 # Fleets hold refs to src and dst planets, but do not change their owners (?)
+# Fleets are only touched on arrival, see Schedule.
+#
+# Players keep running totals of their planets' and fleets' ships, power,
+# production, and strength: planets report every change of their ships to
+# their owner, and owners update the totals as planets and fleets come and
+# go. Player.recount() is the full recomputation, to check against.
+#
+# Nothing in here knows about the UI (or imports pyglet): the UI follows the
+# game through an Observer, see below. All randomness is drawn from random
+# number streams handed out by the Game (see Streams): one for the map, one
+# for the AI, one for combat.
 
 class Player:
-    def __init__( self, name, homeplanet, is_human=False ):
+    def __init__( self, name, homeplanet, is_human=False, rng=random,
+                  schedule=None ):
         self.name = name
-        self.planets = { homeplanet:1 }
-        self.fleets = []
+        self.planets = {}
+        self.fleets = {}
+        self.targets = collections.Counter() # dst planet -> fleets underway
 
         self.is_human_ = is_human
+        self.rng = rng
+        self.schedule = schedule if schedule is not None else Schedule()
+
+        # AI parameters: fraction of a planet's ships to send, and the range
+        # of the (random) minimum fleet size for an attack
+        self.ratio = 0.7
+        self.threshold = ( 15, 50 )
+
+        # The AI proper may be replaced by a strategy (see strategies)
+        self.strategy = None
+
+        # Running totals, see totals()
+        self.total_ships, self.total_power = 0, 0.0
+        self.total_prod, self.total_strength = 0, 0.0
+
+        self.accept_planet( homeplanet )
         
     def is_human( self ):
         return self.is_human_
@@ -30,20 +77,48 @@ class Player:
     def relinquish_planet( self, planet ):
         del self.planets[planet]
 
+        self.add_ships( -planet.ships, planet.strength )
+        self.total_prod -= planet.prod
+        self.total_strength -= planet.strength
+
     def accept_planet( self, planet ):
         self.planets[planet] = 1
 
-    def launch_fleet( self, src, dst, ships, sprite=None ):
-        fleet = Fleet( self, src, dst, ships, sprite )
-        self.fleets.append( fleet )
+        self.add_ships( planet.ships, planet.strength )
+        self.total_prod += planet.prod
+        self.total_strength += planet.strength
+
+    # Ships gained (or lost, if negative) on a planet or in a fleet
+    def add_ships( self, ships, strength ):
+        self.total_ships += ships
+        self.total_power += ships*strength
+
+    def launch_fleet( self, src, dst, ships ):
+        fleet = Fleet( self, src, dst, ships )
+        self.fleets[fleet] = 1
+        self.add_ships( ships, fleet.strength )
+        self.targets[dst] += 1
+        self.schedule.add( fleet )
 
         # print( "%s %s -> %s : %d" % ( self.name, src.name, dst.name, ships ) )
-                      
+        return fleet
 
     def remove_fleet( self, fleet ):
-        self.fleets.remove(fleet)
+        del self.fleets[fleet]
+        self.add_ships( -fleet.ships, fleet.strength )
+
+        self.targets[fleet.dst] -= 1
+        if self.targets[fleet.dst] == 0:
+            del self.targets[fleet.dst]
                 
+    # Returns the list of fleets launched
     def make_move( self, planets ):
+        if self.strategy is not None:
+            return self.strategy.make_move( self, planets )
+
+        launched = []
+        ratio, threshold = self.ratio, self.threshold
+
         # for all owned planets
         for p in self.planets:
             # for all neighbors
@@ -53,20 +128,36 @@ class Player:
                     continue
 
                 # don't attack if not enough ships:
-                if 0.7*p.ships < random.randint( 15, 50 ):
+                if ratio*p.ships < threshold[0]:
+                    break     # ... for any of the remaining neighbors
+                if ratio*p.ships < self.rng.randint( *threshold ):
                     continue
                 
                 # rm planets I already attack
-                if any( f.dst == q for f in self.fleets ):
+                if self.targets[q]:
                     continue
 
                 # ... attack
-                if q.ships < 0.7*p.ships:
-                    self.launch_fleet( p, q, int(0.7*p.ships) ) 
+                if q.ships < ratio*p.ships:
+                    launched.append( self.launch_fleet( p, q,
+                                                        int(ratio*p.ships) ) )
 
         # for f in self.fleets: print( f )
+        return launched
 
-    def stats( self ):
+    # planets, ships, power, prod, (average) strength
+    def totals( self ):
+        planets = len(self.planets)
+
+        strength = 0
+        if planets > 0:
+            strength = self.total_strength/planets
+
+        return ( planets, self.total_ships, self.total_power,
+                 self.total_prod, strength )
+
+    # Same as totals(), but computed from scratch
+    def recount( self ):
         planets = len(self.planets)
         
         ships = sum( [ p.ships for p in self.planets] )
@@ -80,31 +171,57 @@ class Player:
         power = sum( [ p.ships*p.strength for p in self.planets ] )
         power += sum( [ f.ships*f.strength for f in self.fleets ] )
 
+        return ( planets, ships, power, prod, strength )
+
+    # Raises AssertionError if the running totals have gone wrong
+    def check( self ):
+        for x, y in zip( self.totals(), self.recount() ):
+            if not math.isclose( x, y, rel_tol=1e-9, abs_tol=1e-6 ):
+                raise AssertionError( "%s: totals %s, recount %s" %
+                                      ( self.name, self.totals(),
+                                        self.recount() ) )
+
+    # Power is a running sum of floats, which drifts (75.99999999999999 for
+    # 76.0): rounded first, so it shows as the recount would
+    def stats( self ):
+        planets, ships, power, prod, strength = self.totals()
+
         return [ " " + self.name, planets, "%d" % ships,
-                 "%d" % power, "%d" % prod, "%.2f" % strength ]
+                 "%d" % round( power, 6 ), "%d" % prod, "%.2f" % strength ]
 
     
 class Planet:
-    def __init__( self, pos, is_home=False ):
+    def __init__( self, pos, is_home=False, rng=random ):
         self.name = "unk"
         self.owner = None
         self.pos = pos
+        self.idx = None           # index into Distances/Neighborhoods
+        self.distances = None
+        self.ships_ = 0
         if is_home == True:
             self.prod = 10
             self.strength = 0.4
         else:
-            self.prod = random.randint( 5, 15 )        
-            self.strength = random.uniform( 0.1, 1.0 )
+            self.prod = rng.randint( 5, 15 )
+            self.strength = rng.uniform( 0.1, 1.0 )
         self.ships = self.prod
         
-    def find_distances( self, planets ):
-        distances = {}
-        
-        for p in planets:
-            r = math.hypot( p.pos[0]-self.pos[0], p.pos[1]-self.pos[1] )
-            distances[ p ] = r
+    # Changes are passed on to the owner's totals
+    @property
+    def ships( self ):
+        return self.ships_
 
-        self.sorted_neighbors = sorted( distances, key=lambda _: distances[_] )
+    @ships.setter
+    def ships( self, ships ):
+        if self.owner is not None:
+            self.owner.add_ships( ships - self.ships_, self.strength )
+        self.ships_ = ships
+
+    # Planets nearby, nearest first (starting with this one): all planets,
+    # unless the game restricts neighborhoods, see Neighborhoods below
+    @property
+    def sorted_neighbors( self ):
+        return self.distances.neighbors( self.idx )
         
     def propagate( self ):
         if self.owner is not None:
@@ -123,77 +240,313 @@ class Planet:
                  "%.2f" % self.strength, "%.2f" % (self.prod*self.strength) ]
 
     
+# Distances between all pairs of positions, and the indices of each
+# position's neighbors, sorted by distance (nearest first, including the
+# position itself). Computed once per game, and shared by all planets.
+# If items (eg the planets) are given, neighbors() returns those instead of
+# indices.
+#
+# Uses numpy if available (vectorized, float32 optional: dtype="float32"
+# halves the memory); otherwise, falls back to compact arrays of floats.
+class Distances:
+    def __init__( self, positions, items=None, dtype="float64" ):
+        self.items = items
+        n = len(positions)
+
+        np = numpy()
+        if np is not None:
+            pos = np.asarray( positions, dtype=dtype ).reshape( n, 2 )
+            self.matrix = np.hypot( pos[:,0,None] - pos[None,:,0],
+                                    pos[:,1,None] - pos[None,:,1] )
+            order = np.argsort( self.matrix, axis=1, kind="stable" )
+            self.order = order.astype( np.int32 )
+            return
+
+        code = { "float32": "f", "float64": "d" }[ dtype ]
+        self.matrix, self.order = [], []
+        for x, y in positions:
+            row = array.array( code, [ math.hypot( u-x, v-y )
+                                       for u, v in positions ] )
+            order = sorted( range(n), key=row.__getitem__ )
+            self.matrix.append( row )
+            self.order.append( array.array( "i", order ) )
+
+    def distance( self, i, j ):
+        return float( self.matrix[i][j] )
+
+    def neighbors( self, i ):
+        order = self.order[i].tolist()
+        if self.items is None:
+            return order
+
+        items = self.items
+        return [ items[j] for j in order ]
+
+
+# Uniform grid over a set of positions, for nearest-neighbor queries.
+# Cells are sized to hold a couple of positions each, on average.
+class Grid:
+    def __init__( self, positions, per_cell=2 ):
+        self.positions = positions
+
+        xs = [ x for x, _ in positions ]
+        ys = [ y for _, y in positions ]
+        self.x0, self.y0 = min(xs), min(ys)
+        w = max( max(xs) - self.x0, 1.0 )
+        h = max( max(ys) - self.y0, 1.0 )
+
+        self.cell = math.sqrt( per_cell*w*h/len(positions) )
+        self.nx = int( w/self.cell ) + 1
+        self.ny = int( h/self.cell ) + 1
+
+        self.cells = {}
+        for i, ( x, y ) in enumerate( positions ):
+            self.cells.setdefault( self.cell_of( x, y ), [] ).append( i )
+
+    def cell_of( self, x, y ):
+        return ( int( (x-self.x0)/self.cell ), int( (y-self.y0)/self.cell ) )
+
+    # Cells at Chebyshev distance r from cell (cx, cy)
+    def ring( self, cx, cy, r ):
+        if r == 0:
+            yield cx, cy
+            return
+        for dx in range( -r, r+1 ):
+            yield cx+dx, cy-r
+            yield cx+dx, cy+r
+        for dy in range( -r+1, r ):
+            yield cx-r, cy+dy
+            yield cx+r, cy+dy
+
+    # Indices of the k nearest positions within radius of (x, y), nearest
+    # first. Either limit may be None, but not both.
+    #
+    # Searches rings of cells outward; once ring r is done, every position
+    # within r*cell of (x, y) has been seen.
+    def query( self, x, y, k=None, radius=None ):
+        cx, cy = self.cell_of( x, y )
+        last = max( cx, self.nx-1-cx, cy, self.ny-1-cy )
+
+        found = []
+        r = 0
+        while True:
+            for c in self.ring( cx, cy, r ):
+                for i in self.cells.get( c, () ):
+                    u, v = self.positions[i]
+                    d = math.hypot( u-x, v-y )
+                    if radius is None or d <= radius:
+                        found.append( ( d, i ) )
+
+            covered = r*self.cell
+            if radius is not None and covered >= radius:
+                break
+            if k is not None and len(found) >= k:
+                if heapq.nsmallest( k, found )[-1][0] <= covered:
+                    break
+            if r >= last:
+                break
+            r += 1
+
+        found = heapq.nsmallest( k, found ) if k else sorted( found )
+        return [ i for _, i in found ]
+
+
+# Like Distances, but each position only knows its k nearest neighbors, or
+# those within radius (or both); found through a Grid, in O(n k) rather
+# than O(n^2) time and memory.
+class Neighborhoods:
+    def __init__( self, positions, items=None, k=None, radius=None ):
+        self.items = items
+        self.positions = [ ( float(x), float(y) ) for x, y in positions ]
+
+        grid = Grid( self.positions )
+        self.order = []
+        for i, ( x, y ) in enumerate( self.positions ):
+            near = grid.query( x, y, k+1 if k else None, radius )
+            if i in near:
+                near.remove( i )
+            self.order.append( array.array( "i", [ i ] + near[:k] ) )
+
+    def distance( self, i, j ):
+        ( x, y ), ( u, v ) = self.positions[i], self.positions[j]
+        return math.hypot( u-x, v-y )
+
+    def neighbors( self, i ):
+        if self.items is None:
+            return self.order[i].tolist()
+
+        items = self.items
+        return [ items[j] for j in self.order[i] ]
+
+
+# Distances (all pairs) by default; restricted Neighborhoods if either
+# limit is given.
+def neighbor_index( positions, items=None, k=None, radius=None,
+                    dtype="float64" ):
+    if k is None and radius is None:
+        return Distances( positions, items, dtype )
+    return Neighborhoods( positions, items, k, radius )
+
+
+# Battle resolvers.
+# Each takes the number of attacking and defending ships and their strengths,
+# and returns the survivors as a tuple ( attack, defense ). Once a battle has
+# begun, it is fought to the end: one of the two survivor counts is zero.
+#
+# In every round of a battle exactly one ship is lost: a defending ship with
+# probability p = sa/(sa+sd), an attacking ship otherwise. battle_exact()
+# plays out each round; battle_sampled() draws the outcome of the same race
+# directly, which takes (expected) constant time, regardless of fleet sizes.
+
+def battle_exact( attack, defense, sa, sd, rng=random ):
+    while attack > 0 and defense > 0:
+        r = rng.uniform( 0, sa + sd )
+
+        if r < sa:
+            defense -= 1
+        else:
+            attack -= 1
+
+        # print( attack, ">", defense )
+
+    return attack, defense
+
+
+def battle_sampled( attack, defense, sa, sd, rng=random ):
+    if attack <= 0 or defense <= 0:
+        return attack, defense
+
+    if attack*sa >= defense*sd:
+        return race( attack, defense, sa/(sa + sd), rng )
+
+    defense, attack = race( defense, attack, sd/(sa + sd), rng )
+    return attack, defense
+
+
+# Battle between the favorite (fav ships) and the underdog (dog ships);
+# in each round, the underdog loses a ship with probability p.
+# Returns the survivors ( fav, dog ).
+#
+# The underdog's losses before the favorite is wiped out are negative-
+# binomial: if fewer than its ships, the underdog wins, and this is exact.
+# Otherwise the favorite won, and its own losses are drawn, conditioned on
+# winning, by rejection. The favorite wins at least about half the time, so
+# that takes two draws on average - regardless of how the first draw came
+# out. (Rejecting on the rare outcome instead can take arbitrarily long.)
+def race( fav, dog, p, rng=random ):
+    j = negative_binomial( fav, 1-p, rng )
+    if j < dog:
+        return 0, dog - j
+
+    while True:
+        k = negative_binomial( dog, p, rng )
+        if k < fav:
+            return fav - k, 0
+
+
+BATTLES = { "exact": battle_exact, "sampled": battle_sampled }
+
+
+# Number of failures before the r-th success in Bernoulli trials with
+# success probability p, drawn as a Gamma-Poisson mixture.
+def negative_binomial( r, p, rng=random ):
+    if p >= 1.0:
+        return 0
+
+    return poisson( rng.gammavariate( r, (1.0-p)/p ), rng )
+
+
+# Poisson variates: multiplication method for small means, and Hoermann's
+# transformed rejection with squeeze (PTRS) otherwise. Both need O(1)
+# uniform variates on average (for the small means used).
+def poisson( lam, rng=random ):
+    if lam <= 0.0:
+        return 0
+
+    if lam < 10.0:
+        limit = math.exp( -lam )
+        k, prod = 0, rng.random()
+        while prod > limit:
+            k += 1
+            prod *= rng.random()
+        return k
+
+    slam, loglam = math.sqrt( lam ), math.log( lam )
+    b = 0.931 + 2.53*slam
+    a = -0.059 + 0.02483*b
+    invalpha = 1.1239 + 1.1328/(b - 3.4)
+    vr = 0.9277 - 3.6224/(b - 2)
+
+    while True:
+        u = rng.random() - 0.5
+        v = rng.random()
+        us = 0.5 - abs(u)
+        k = int( math.floor( (2*a/us + b)*u + lam + 0.43 ) )
+
+        if us >= 0.07 and v <= vr:
+            return k
+        if k < 0 or ( us < 0.013 and v > us ):
+            continue
+        if ( math.log(v) + math.log(invalpha) - math.log(a/(us*us) + b) <=
+             -lam + k*loglam - math.lgamma(k+1) ):
+            return k
+
+
+# Fleets fly in a straight line at constant speed, so their turn of arrival
+# is known at launch: nothing needs to be done for a fleet until then. Its
+# position is only computed when asked for (eg by the UI), from the current
+# turn, which is kept by the Schedule.
+
+FLEET_SPEED = 15.0
+
+# The course of a fleet between two positions: its velocity, and the number
+# of turns until it arrives. Fleets start with an initial step in direction,
+# to get away from the planet, then take one step per turn. After k steps,
+# they are |v - speed*(1.75+k)| from dst; arrival is the first time that is
+# below 20 (but no later than the first step, for close planets)
+def course( src, dst ):
+    vx, vy = dst[0] - src[0], dst[1] - src[1]
+    v = math.hypot( vx, vy )
+    if v > 0:
+        velocity = ( FLEET_SPEED*vx/v, FLEET_SPEED*vy/v )
+    else:
+        velocity = ( 0.0, 0.0 )
+    return velocity, max( 1, math.floor( (v-20)/FLEET_SPEED - 1.75 ) + 1 )
+
 class Fleet:
-    def __init__( self, owner, src, dst, ships, sprite=None ):
+    def __init__( self, owner, src, dst, ships ):
         self.owner = owner
-        self.src = src      # unused as member, could be cut
+        self.src = src
         self.dst = dst
         self.ships = ships
-        self.pos = src.pos
         self.strength = src.strength
+        self.schedule = owner.schedule
 
         self.src.ships -= ships   # very important!
         
-        self.sprite = sprite
-        self.offset = 15          # half planet width!
-        
-        speed = 15.0
-        vx = dst.pos[0] - src.pos[0]
-        vy = dst.pos[1] - src.pos[1]
-        v = math.hypot( vx, vy )
-        self.velocity = ( speed*vx/v, speed*vy/v ) if v > 0 else 0
-
-        # Make an initial step in direction; to get away from planet
-        self.pos = ( self.pos[0] + 1.75*self.velocity[0],
-                     self.pos[1] + 1.75*self.velocity[1] )
-        
-        if sprite:
-            phi = 180*math.atan2( vx/v, vy/v )/math.pi
-            self.sprite.update( x=self.pos[0]+self.offset,
-                                y=self.pos[1]+self.offset,
-                                rotation=phi )
+        self.velocity, turns = course( src.pos, dst.pos )
+        self.launched = self.schedule.turn
+        self.arrival = self.launched + turns
+
+    @property
+    def pos( self ):
+        k = 1.75 + self.schedule.turn - self.launched
+        return ( self.src.pos[0] + k*self.velocity[0],
+                 self.src.pos[1] + k*self.velocity[1] )
 
     def __str__( self ):
         return "%s : %d : %s -> %s" % ( self.owner.name, self.ships,
                                         self.src.name, self.dst.name )
         
-    def propagate( self ):
-        self.pos = ( self.pos[0] + self.velocity[0],
-                     self.pos[1] + self.velocity[1] )
-
-        if math.hypot( self.dst.pos[0] - self.pos[0],
-                       self.dst.pos[1] - self.pos[1] ) < 20:
-            # attack
-            if self.sprite:
-                self.sprite.delete()
-            self.owner.remove_fleet( self )
-            return True
-        
-        if self.sprite:
-            self.sprite.update( x=self.pos[0]+self.offset,
-                                y=self.pos[1]+self.offset )
-
-        return False
-        
-    def fight( self ):
+    def fight( self, battle=battle_sampled, rng=random ):
         # Don't fight if same owner
         if self.owner == self.dst.owner:
             self.dst.ships += self.ships
             return True # is friendly landing, not attack
 
         # Different owners: fight
-        attack = self.ships
-        defense = self.dst.ships
-
-        while attack > 0 and defense > 0:
-            r = random.uniform( 0, self.strength + self.dst.strength )
-            
-            if r < self.strength:
-                defense -= 1
-            else:
-                attack -= 1
-
-            # print( attack, ">", defense )
+        attack, defense = battle( self.ships, self.dst.ships,
+                                  self.strength, self.dst.strength, rng )
 
         """
         print( "%s %d > %d : %d > %d (%d,%d)" % ( self.owner.name, 
@@ -214,100 +567,202 @@ class Fleet:
         return False
         
 
+# Random number streams (random.Random instances), one for each part of the
+# game, all derived from one seed (None: a seed is drawn):
+# - map: shuffling the positions, planet stats
+# - ai: the AI's decisions (see Player.make_move)
+# - combat: battles, and the order in which players' fleets arrive
+# The streams are independent: drawing more (or fewer) numbers from one,
+# say because of a different AI, does not change those drawn from the others.
+# A seed gives the same streams in every process (str seeds are hashed with
+# sha512, not with hash()).
+#
+# For batched draws, generator() gives a numpy Generator, seeded from a
+# stream of its own (requires numpy).
+class Streams:
+    names = ( "map", "ai", "combat" )
+
+    def __init__( self, seed=None ):
+        if seed is None:
+            seed = random.randrange( 2**63 )
+        self.seed = seed
+
+        for name in self.names:
+            setattr( self, name, self.stream( name ) )
+        self.generators = {}
+
+    def stream( self, name ):
+        return random.Random( "%s/%s" % ( self.seed, name ) )
+
+    def generator( self, name ):
+        if name not in self.generators:
+            np = numpy()
+            if np is None:
+                raise ImportError( "Streams.generator() requires numpy" )
+            bits = self.stream( "numpy/" + name ).getrandbits( 128 )
+            self.generators[ name ] = np.random.default_rng( bits )
+        return self.generators[ name ]
+
+    # State of all streams (and generators), to save and restore a game
+    def getstate( self ):
+        state = { name: getattr( self, name ).getstate()
+                  for name in self.names }
+        for name, gen in self.generators.items():
+            state[ "numpy/" + name ] = gen.bit_generator.state
+        return state
+
+    def setstate( self, state ):
+        for key, value in state.items():
+            if key.startswith( "numpy/" ):
+                self.generator( key[6:] ).bit_generator.state = value
+            else:
+                getattr( self, key ).setstate( value )
+
+
+# The current turn, and all fleets underway in a heap, by turn of arrival.
+# Fleets due in the same turn come out in the order they were launched.
+class Schedule:
+    def __init__( self ):
+        self.turn = 0
+        self.heap = []
+        self.seq = 0
+
+    def __len__( self ):
+        return len( self.heap )
+
+    def add( self, fleet ):
+        heapq.heappush( self.heap, ( fleet.arrival, self.seq, fleet ) )
+        self.seq += 1
+
+    # Fleets arriving by the current turn; they are removed from the heap
+    def due( self ):
+        fleets = []
+        while self.heap and self.heap[0][0] <= self.turn:
+            fleets.append( heapq.heappop( self.heap )[2] )
+        return fleets
+
+
+# Receives notifications from a Game, for instance to keep a UI in sync.
+# The game runs fine without one: override only what is of interest.
+#
+# All calls happen after the game state has been updated.
+class Observer:
+    # Planets are placed, players have their homeplanets
+    def game_started( self, game ): pass
+
+    # Fleets launched by any player, including the AIs
+    def fleet_launched( self, fleet ): pass
+
+    # Fleet has arrived at fleet.dst, and the battle has been fought
+    def fleet_arrived( self, fleet, is_support ): pass
+
+    # All fleets have moved and all AIs have made their moves. Fleets don't
+    # report their moves: query fleet.pos as needed
+    def turn_finished( self, game ): pass
+
+
+# The game proper. Players are the human (index 0) and the AI opponents;
+# planets are the players' homeplanets, followed by the neutral planets.
+# Positions are drawn at random (without replacement) from the given list.
+# All random numbers come from streams derived from the seed, see Streams.
+# With autopilot, the AI moves on behalf of the human as well.
+# The AI only considers targets among the nearest neighbors (at most that
+# many, within radius; default: all planets), see neighbor_index().
+# The dtype is used for the distance matrix, see Distances.
+# With check, the players' running totals are verified after every turn.
 class Game:
-    def __init__( self, players, planets, buttons, fleet_mkr, battle_mkr,
-                  support_mkr, positions, tbl1, tbl2 ):
+    def __init__( self, players, planets, positions, seed=None,
+                  battle="sampled", observer=None, autopilot=False,
+                  neighbors=None, radius=None, dtype="float64",
+                  check=False ):
         self.planets = []
         self.players = []
 
-        self.fleet_maker = fleet_mkr
-        self.battle_maker = battle_mkr
-        self.support_maker = support_mkr
+        self.streams = Streams( seed )
+        self.seed = self.streams.seed
+        self.schedule = Schedule()
+
+        # Battle resolver, see BATTLES
+        self.battle = BATTLES[ battle ]
+
+        self.observer = observer or Observer()
+        self.autopilot = autopilot
+        self.check = check
         
         # Index into positions[] is advanced "manually" three times below!
-        random.shuffle( positions )
+        positions = list( positions )
+        rng = self.streams.map
+        rng.shuffle( positions )
         
         # Players and Planets
         # First player (i=0) is human
-        p = Planet( positions[0], is_home=True )
-        self.players.append( Player( "human", p, is_human=True ) )
+        p = Planet( positions[0], is_home=True, rng=rng )
+        self.players.append( Player( "human", p, is_human=True,
+                                     rng=self.streams.ai,
+                                     schedule=self.schedule ) )
         p.owner = self.players[-1]
         self.planets.append( p )
 
         # Players and their homeplanets
         for i in range( players ):
-            p = Planet( positions[1+i], is_home=True )
-            self.players.append( Player( "AI%0d" % i, p ) )
+            p = Planet( positions[1+i], is_home=True, rng=rng )
+            self.players.append( Player( "AI%0d" % i, p,
+                                         rng=self.streams.ai,
+                                         schedule=self.schedule ) )
             p.owner = self.players[-1]            
             self.planets.append( p )
             
         # Neutral Planets
         for i in range( planets ):
-            self.planets.append( Planet( positions[1+players+i] ) )
+            self.planets.append( Planet( positions[1+players+i],
+                                         rng=rng ) )
 
         # All planets need to know distances to each other:
-        for p in self.planets:
-            p.find_distances( self.planets )
-
-        # Update UI planets with position info; grab the names from UI buttons
-        for i in range( len(self.planets) ):
-            buttons[i].x = self.planets[i].pos[0]
-            buttons[i].y = self.planets[i].pos[1]
-            
-            self.planets[i].name = buttons[i].name
-
-            # print( self.planets[i].name, self.planets[i].pos )
-            
-        # Populate tables : direct copy from propagate()
-        for row, p in enumerate(self.players):
-            for col, s in enumerate(p.stats()):
-                tbl1.set_text( 1+row, col, str( s ) ) 
-
-        for row, p in enumerate(self.planets):
-            stats = p.stats()
-            for col, s in enumerate(p.stats()):
-                tbl2.set_text( 1+row, col, str( s ) )
-
+        self.neighbors, self.radius, self.dtype = neighbors, radius, dtype
+        self.distances = neighbor_index( [ p.pos for p in self.planets ],
+                                         self.planets, neighbors, radius,
+                                         dtype )
+        for i, p in enumerate( self.planets ):
+            p.idx, p.distances = i, self.distances
+
+        # Default names; a UI may replace them
+        for i, p in enumerate( self.planets ):
+            p.name = "P%02d" % i
+
+        self.observer.game_started( self )
             
     # kbd event
-    def propagate( self, tbl1, tbl2 ):
+    def propagate( self ):
         for p in self.planets:
             p.propagate()
 
         shuffled_players = list( range( len(self.players) ) )
-        random.shuffle( shuffled_players )
+        self.streams.combat.shuffle( shuffled_players )
         
-        for i in shuffled_players:
-            for f in self.players[i].fleets:
-                arrived = f.propagate()
+        # Arrivals: by player (in shuffled order), then in launch order
+        self.schedule.turn += 1
 
-                # if arrived: fight
-                if arrived:
-                    is_support = f.fight()
-                    
+        rank = { self.players[i]: r for r, i in enumerate( shuffled_players ) }
+        arrivals = self.schedule.due()
+        arrivals.sort( key=lambda f: rank[f.owner] )
 
-                    if is_support:
-                        support = self.support_maker( x=f.dst.pos[0]+15-24,
-                                                      y=f.dst.pos[1]+15-24 )
-                    else:
-                        # offset: 15=half planet width; 24=half explosion width
-                        battle = self.battle_maker( x=f.dst.pos[0]+15-24,
-                                                    y=f.dst.pos[1]+15-24 )
-                    
+        for f in arrivals:
+            is_support = f.fight( self.battle, self.streams.combat )
+            f.owner.remove_fleet( f )
+            self.observer.fleet_arrived( f, is_support )
                     
         for i in shuffled_players:
-            if self.players[i].is_active() and not self.players[i].is_human():
-                self.players[i].make_move( self.planets ) 
+            if not self.players[i].is_active():
+                continue
+            if self.autopilot or not self.players[i].is_human():
+                for f in self.players[i].make_move( self.planets ):
+                    self.observer.fleet_launched( f )
             
-        # pass info to display - remember: room for header line!
-        for row, p in enumerate(self.players):
-            for col, s in enumerate(p.stats()):
-                tbl1.set_text( 1+row, col, str( s ) ) 
+        if self.check:
+            for p in self.players:
+                p.check()
 
-        for row, p in enumerate(self.planets):
-            stats = p.stats()
-            for col, s in enumerate(p.stats()):
-                tbl2.set_text( 1+row, col, str( s ) )
+        self.observer.turn_finished( self )
 
         # check for game over
         alive_players = 0
@@ -338,5 +793,5 @@ class Game:
         src = self.planets[src_idx]
         dst = self.planets[dst_idx]
 
-        self.players[0].launch_fleet( src, dst, size, 
-                                      sprite=self.fleet_maker() )
+        fleet = self.players[0].launch_fleet( src, dst, size )
+        self.observer.fleet_launched( fleet )
@@ -0,0 +1,190 @@
+
+import random
+import time
+import weakref
+
+# if run as a script, pull from local directory
+# otherwise (if run as module), pull from package
+if __package__:
+    from . import snapshot
+    from . import strategies
+else:
+    import snapshot
+    import strategies
+
+# An AI that looks ahead: it considers a few candidate moves, and plays each
+# of them out in copies of the game (see snapshot.fork), for a number of
+# turns, with all players (itself included) using the built-in AI from the
+# next turn on. The candidate with the best average outcome is played.
+#
+# Rollouts are random (each copy gets fresh random numbers for the AI and
+# for combat), so each candidate is played out repeatedly: one rollout per
+# candidate in each round, for as many rounds as fit into the time budget.
+# The search can be cut off at any time: a rollout that runs out of time is
+# dropped, and the candidates are judged by the rollouts completed so far.
+# Without any, the built-in AI moves. A rollout doesn't start a copy, or a
+# turn, that isn't expected to be done by the deadline (see time_for()).
+#
+# The budget (in millisecs) is per turn, not per move: all lookahead players
+# of a game share it. The first of them to move in a turn sets the turn's
+# deadline, and each gets an even share of the time left to those still to
+# move (see deadline()), so a turn takes about the budget, however many
+# lookahead players there are.
+#
+# Candidates: do nothing; the built-in AI's move; and attacks from each
+# planet with enough ships on each of a few nearest planets that are weaker.
+#
+# Usage: game.players[i].strategy = Lookahead( game )
+#
+# A strategy (see strategies), for gamelogic.Game only. In the copies, all
+# players use the built-in AI, whatever their strategy. The lookahead
+# depends on the time budget, so games with a lookahead AI can't be
+# replayed (see replay) reliably.
+
+class Lookahead( strategies.Strategy ):
+    name = "lookahead"
+
+    def __init__( self, game, budget=20.0, depth=10, targets=3,
+                  candidates=12, seed=None ):
+        super().__init__( game )
+        self.budget = budget
+        self.depth = depth
+        self.targets = targets
+        self.candidates = candidates
+        self.seeds = random.Random( seed )   # for the copies
+        self.costs = { "fork": 0.0, "turn": 0.0 }    # see took()
+
+        self.rollouts = 0         # in total, for statistics
+
+    def moves( self, galaxy, me ):
+        deadline = self.deadline()
+
+        moves = self.candidate_moves( galaxy, me )
+        scores = [ [] for _ in moves ]
+
+        while time.perf_counter() < deadline:
+            for k, move in enumerate( moves ):
+                score = self.rollout( me, move, deadline )
+                if score is None:
+                    break
+                scores[k].append( score )
+                self.rollouts += 1
+
+        # Only compare candidates with the same number of rollouts
+        n = min( len(s) for s in scores )
+        if n == 0:
+            return moves[1]
+
+        best = max( range( len(moves) ), key=lambda k: sum( scores[k][:n] ) )
+        return moves[best]
+
+    # The deadline of this move: an even share of what is left of the
+    # turn's budget, among the lookahead players still to move
+    def deadline( self ):
+        game = self.game
+        now = time.perf_counter()
+
+        turn = turns.get( game )
+        if turn is None or turn[0] != game.schedule.turn:
+            players = [ p for p in game.players
+                        if isinstance( p.strategy, Lookahead ) and
+                        p.is_active() and
+                        ( game.autopilot or not p.is_human() ) ]
+            turn = turns[ game ] = [ game.schedule.turn,
+                                     now + self.budget/1000,
+                                     len( players ) ]
+
+        _, end, left = turn
+        turn[2] = max( left-1, 1 )
+        return now + max( end - now, 0.0 )/max( left, 1 )
+
+    # Is there time for another step (a copy, or a turn) before the
+    # deadline? Judged by how long such steps took recently
+    def time_for( self, step, deadline ):
+        return time.perf_counter() + self.costs[ step ] < deadline
+
+    # The cost of a step: the longest recent one (decaying)
+    def took( self, step, start ):
+        dt = time.perf_counter() - start
+        self.costs[ step ] = max( dt, 0.9*self.costs[ step ] )
+
+    # Candidate moves, each a list of launches ( src, dst, ships )
+    def candidate_moves( self, galaxy, me ):
+        # The built-in AI's move, made in a copy of the game
+        copy = self.fork()
+        greedy = [ ( f.src.idx, f.dst.idx, f.ships ) for f in
+                   copy.players[me].make_move( copy.planets ) ]
+
+        moves = [ [], greedy ]
+        player = self.game.players[me]
+        ships, owner = galaxy.ships, galaxy.owner
+        targets = galaxy.targets( me )
+        for p in player.planets:
+            send = int( player.ratio*ships[p.idx] )
+            if send < player.threshold[0]:
+                continue
+
+            found = 0
+            for q in p.distances.order[ p.idx ].tolist():
+                if owner[q] == me or targets[q] or ships[q] >= send:
+                    continue
+                moves.append( [ ( p.idx, q, send ) ] )
+                found += 1
+                if found == self.targets:
+                    break
+
+        return moves[ :self.candidates ]
+
+    # A copy of the game, with the built-in AI for all players
+    def fork( self ):
+        game = snapshot.fork( self.game )
+        for p in game.players:
+            p.strategy = None
+        return game
+
+    # Final score for player me, after playing the move and depth turns;
+    # None, if the deadline is reached first
+    def rollout( self, me, move, deadline ):
+        if not self.time_for( "fork", deadline ):
+            return None
+        start = time.perf_counter()
+        game = self.fork()
+        self.took( "fork", start )
+
+        game.autopilot = True
+        game.streams.ai.seed( self.seeds.getrandbits( 64 ) )
+        game.streams.combat.seed( self.seeds.getrandbits( 64 ) )
+
+        player = game.players[me]
+        for src, dst, ships in move:
+            player.launch_fleet( game.planets[src], game.planets[dst], ships )
+
+        for _ in range( self.depth ):
+            if not self.time_for( "turn", deadline ):
+                return None
+            start = time.perf_counter()
+            alive = game.propagate()
+            self.took( "turn", start )
+            if alive <= 1:
+                break
+
+        return self.score( game, me )
+
+    # Share of all power (ships weighted by strength), plus share of all
+    # production
+    @staticmethod
+    def score( game, me ):
+        power = sum( p.total_power for p in game.players )
+        prod = sum( p.total_prod for p in game.players )
+
+        player = game.players[me]
+        score = player.total_power/power if power > 0 else 0.0
+        score += player.total_prod/prod if prod > 0 else 0.0
+        return score
+
+
+# The turn of each game being played: [ turn, deadline, lookahead players
+# still to move ], see Lookahead.deadline()
+turns = weakref.WeakKeyDictionary()
+
+strategies.register( Lookahead )
@@ -0,0 +1,109 @@
+
+import functools
+import math
+import random
+
+# Galaxy maps: planet positions, none closer to another than the spacing.
+#
+# Positions are drawn by Bridson's algorithm for Poisson-disk sampling
+# ("blue noise"): new points are tried around the points found so far,
+# until none fits any more. A background grid, with cells so small that
+# each can hold at most one point, makes checking a candidate against its
+# neighbors O(1), and the whole map O(n).
+#
+# Candidates are tried on a ring just outside the spacing, at evenly spaced
+# angles (M. Roberts' variant of the algorithm): this fills the map more
+# densely, with fewer tries, than random candidates on the annulus from one
+# to two times the spacing.
+#
+# Maps are cached, by seed and parameters (see galaxy_map()). The same seed
+# and parameters always give the same map.
+
+DENSITY = 0.8       # points per spacing**2 of area, at least (tries=12)
+
+def poisson_disk( width, height, spacing, seed=None, tries=12 ):
+    rng = random.Random( seed )
+    cell = spacing/math.sqrt( 2 )
+
+    # The grid has a border of two empty cells all around, so that the
+    # cells around any point are all inside. Cells hold the coordinates of
+    # their point; empty cells a point far away.
+    cols, rows = int( width/cell ) + 5, int( height/cell ) + 5
+    far = -10.0*( width + height + spacing )
+    gx, gy = [ far ]*( cols*rows ), [ far ]*( cols*rows )
+
+    # Neighbors can only be in the 5x5 cells around a point (w/o corners)
+    # (nearest first: those are most likely to be taken)
+    cells = [ ( i, j ) for j in range( -2, 3 ) for i in range( -2, 3 )
+              if abs(i) + abs(j) < 4 ]
+    cells.sort( key=lambda ij: ij[0]**2 + ij[1]**2 )
+    around = [ j*cols + i for i, j in cells ]
+
+    # Candidates: ring, rotated by a random angle for each point
+    radius = spacing*1.000001        # just outside: no rounding trouble
+    ring = [ ( radius*math.cos( 2*math.pi*t/tries ),
+               radius*math.sin( 2*math.pi*t/tries ) ) for t in range( tries ) ]
+    r2 = spacing*spacing
+
+    points = []
+    def add( x, y ):
+        c = ( int( y/cell ) + 2 )*cols + int( x/cell ) + 2
+        gx[c], gy[c] = x, y
+        points.append( ( x, y ) )
+
+    add( rng.uniform( 0, width ), rng.uniform( 0, height ) )
+    active = [ 0 ]
+    cos, sin = math.cos, math.sin
+
+    while active:
+        a = rng.randrange( len(active) )
+        x0, y0 = points[ active[a] ]
+        phi = rng.uniform( 0, 2*math.pi )
+        c, s = cos( phi ), sin( phi )
+
+        for u, v in ring:
+            x, y = x0 + c*u - s*v, y0 + s*u + c*v
+            if not ( 0 <= x < width and 0 <= y < height ):
+                continue
+
+            base = ( int( y/cell ) + 2 )*cols + int( x/cell ) + 2
+            for o in around:
+                dx, dy = gx[base+o] - x, gy[base+o] - y
+                if dx*dx + dy*dy < r2:
+                    break
+            else:
+                active.append( len( points ) )
+                add( x, y )
+                break
+        else:
+            # No candidate fits: this point is done
+            active[a] = active[-1]
+            active.pop()
+
+    return points
+
+
+# Side length of a square map that holds (at least) count points
+def map_size( count, spacing ):
+    return spacing*math.sqrt( count/DENSITY )
+
+
+# Positions for a galaxy of the given size, offset by margin from each
+# edge. Without a seed, a seed is drawn: each call gives a new map.
+# Maps are cached (by seed and parameters); callers must not change them.
+def galaxy_map( width, height, spacing, seed=None, margin=0, tries=12 ):
+    if seed is None:
+        seed = random.randrange( 2**32 )
+    return cached_map( width, height, spacing, seed, margin, tries )
+
+@functools.lru_cache( maxsize=32 )
+def cached_map( width, height, spacing, seed, margin, tries ):
+    points = poisson_disk( width - 2*margin, height - 2*margin, spacing,
+                           seed, tries )
+    return tuple( ( margin + x, margin + y ) for x, y in points )
+
+
+# The map of the game board: 640x640, planets are 30 px wide (positions are
+# their lower left corners), and stay 20 px away from the edges.
+def board_map( seed=None ):
+    return galaxy_map( 640-30, 640-30, 40, seed=seed, margin=20 )
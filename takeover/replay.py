@@ -0,0 +1,261 @@
+
+import argparse
+import struct
+import time
+
+# if run as a script, pull from local directory
+# otherwise (if run as module), pull from package
+if __package__:
+    from . import snapshot
+else:
+    import snapshot
+
+# Recording and replaying games (gamelogic.Game).
+#
+# A game is determined by its initial state (which includes the seeds of the
+# random number streams) and by the human's launches: everything else is
+# drawn from the streams. The log therefore holds a snapshot of the initial
+# state, and the human's launches in each turn; and, to seek quickly, a
+# snapshot (keyframe) every so many turns. Replaying a turn means applying
+# its launches, then propagating. The state at turn t is the state after t
+# turns have been propagated (the schedule's turn), before the launches of
+# turn t.
+#
+# The log is append-only: a sequence of records, each a type byte and a
+# fixed-size payload (keyframes: followed by the snapshot).
+#   K turn length <snapshot>   keyframe: the state at the turn
+#   L src dst ships            launch by the human, in the current turn
+#   T                          end of turn: propagate
+#   B turn                     back to an earlier turn: the rest is dropped
+# Records are appended as the game goes on; if a file is given, they are
+# written to it as well, so that the log survives a crash.
+
+MAGIC = b"TKRL"
+VERSION = 1
+
+HEADER = struct.Struct( "<4sHI" )       # magic, version, keyframe interval
+KEYFRAME = struct.Struct( "<cqI" )
+LAUNCH = struct.Struct( "<ciiq" )
+TURN = struct.Struct( "<c" )
+BACK = struct.Struct( "<cq" )
+
+
+class ReplayError( Exception ):
+    pass
+
+
+# The contents of a log: keyframes by turn, launches by turn, and the last
+# turn recorded.
+class Log:
+    def __init__( self, interval=50 ):
+        self.interval = interval
+        self.keyframes = {}       # turn -> snapshot
+        self.launches = {}        # turn -> [ ( src, dst, ships ) ]
+        self.end = 0
+
+    def keyframe( self, turn, data ):
+        self.keyframes[ turn ] = data
+        self.end = max( self.end, turn )
+
+    def launch( self, turn, src, dst, ships ):
+        self.launches.setdefault( turn, [] ).append( ( src, dst, ships ) )
+
+    def turn( self, turn ):
+        self.end = max( self.end, turn+1 )
+
+    def back( self, turn ):
+        for t in [ t for t in self.keyframes if t > turn ]:
+            del self.keyframes[t]
+        for t in [ t for t in self.launches if t >= turn ]:
+            del self.launches[t]
+        self.end = turn
+
+    # Apply the launches of the game's turn, then propagate
+    def advance( self, game ):
+        for src, dst, ships in self.launches.get( game.schedule.turn, [] ):
+            game.launch_fleet( src, dst, ships )
+        return game.propagate()
+
+    # The game at the given turn, re-simulated from the nearest keyframe
+    def game_at( self, turn, observer=None ):
+        if not 0 <= turn <= self.end:
+            raise ReplayError( "No turn %d in replay (0..%d)" %
+                               ( turn, self.end ) )
+
+        start = max( t for t in self.keyframes if t <= turn )
+        game = snapshot.loads( self.keyframes[start], observer )
+        while game.schedule.turn < turn:
+            self.advance( game )
+        return game
+
+    # Raises ReplayError for anything but a complete replay
+    @staticmethod
+    def read( data ):
+        try:
+            return Log.parse( data )
+        except ( struct.error, IndexError ) as e:
+            raise ReplayError( "truncated replay" ) from e
+
+    @staticmethod
+    def parse( data ):
+        magic, version, interval = HEADER.unpack_from( data, 0 )
+        if magic != MAGIC:
+            raise ReplayError( "Not a replay" )
+        if version != VERSION:
+            raise ReplayError( "Unsupported replay version %d" % version )
+
+        log = Log( interval )
+        data = memoryview( data )
+        pos, turn = HEADER.size, 0
+        while pos < len( data ):
+            kind = bytes( data[ pos:pos+1 ] )
+            if kind == b"K":
+                _, turn, n = KEYFRAME.unpack_from( data, pos )
+                pos += KEYFRAME.size
+                if pos + n > len( data ):
+                    raise ReplayError( "truncated replay" )
+                log.keyframe( turn, bytes( data[ pos:pos+n ] ) )
+                pos += n
+            elif kind == b"L":
+                _, src, dst, ships = LAUNCH.unpack_from( data, pos )
+                pos += LAUNCH.size
+                log.launch( turn, src, dst, ships )
+            elif kind == b"T":
+                pos += TURN.size
+                log.turn( turn )
+                turn += 1
+            elif kind == b"B":
+                _, turn = BACK.unpack_from( data, pos )
+                pos += BACK.size
+                log.back( turn )
+            else:
+                raise ReplayError( "Bad record at offset %d" % pos )
+
+        if 0 not in log.keyframes:
+            raise ReplayError( "truncated replay" )
+        return log
+
+
+# Records a game as it is played. Use the recorder's propagate() and
+# launch_fleet() instead of the game's. After seek(), or a propagate() with
+# a resolved turn, recorder.game is a different game object!
+class Recorder:
+    def __init__( self, game, interval=50, path=None ):
+        self.game = game
+        self.log = Log( interval )
+        self.records = bytearray()
+        self.file = open( path, "wb" ) if path else None
+
+        self.append( HEADER.pack( MAGIC, VERSION, interval ) )
+        self.keyframe()
+
+    def append( self, record ):
+        self.records += record
+        if self.file:
+            self.file.write( record )
+
+    def keyframe( self ):
+        turn = self.game.schedule.turn
+        data = snapshot.dumps( self.game )
+        self.log.keyframe( turn, data )
+        self.append( KEYFRAME.pack( b"K", turn, len(data) ) + data )
+
+    # Playing on from an earlier turn drops the turns after it
+    def branch( self ):
+        turn = self.game.schedule.turn
+        if turn < self.log.end:
+            self.log.back( turn )
+            self.append( BACK.pack( b"B", turn ) )
+
+    def launch_fleet( self, src_idx, dst_idx, size ):
+        if size == 0:
+            return
+
+        self.branch()
+        self.game.launch_fleet( src_idx, dst_idx, size )
+        self.log.launch( self.game.schedule.turn, src_idx, dst_idx, size )
+        self.append( LAUNCH.pack( b"L", src_idx, dst_idx, size ) )
+
+    # Turns resolved elsewhere (see worker) are passed in as the game after
+    # them, with the number of players alive: it replaces the game. There
+    # may be several turns, without launches in between.
+    def propagate( self, resolved=None, alive=None ):
+        self.branch()
+        turn = self.game.schedule.turn
+
+        if resolved is None:
+            alive = self.game.propagate()
+        else:
+            self.game = resolved
+
+        for t in range( turn, self.game.schedule.turn ):
+            self.log.turn( t )
+            self.append( TURN.pack( b"T" ) )
+
+        # A keyframe every interval turns (or as soon after as possible)
+        interval = self.log.interval
+        if self.game.schedule.turn//interval > turn//interval:
+            self.keyframe()
+        if self.file:
+            self.file.flush()
+        return alive
+
+    # Go to any recorded turn; one turn forward is replayed on the current
+    # game (with its observer), anything else comes from a keyframe. Back
+    # at the last turn, the launches made in it so far are made again.
+    def seek( self, turn, observer=None ):
+        if turn == self.game.schedule.turn + 1 and turn <= self.log.end:
+            self.log.advance( self.game )
+        else:
+            self.game = self.log.game_at( turn, observer )
+
+        if turn == self.log.end:
+            for src, dst, ships in self.log.launches.get( turn, [] ):
+                self.game.launch_fleet( src, dst, ships )
+        return self.game
+
+    def save( self, path ):
+        with open( path, "wb" ) as f:
+            f.write( self.records )
+
+    def close( self ):
+        if self.file:
+            self.file.close()
+            self.file = None
+
+
+def load( path ):
+    with open( path, "rb" ) as f:
+        return Log.read( f.read() )
+
+
+# ------------------------------------------------------------
+# Re-simulate a recorded game, headless, and show the players at a turn
+
+def main( argv=None ):
+    parser = argparse.ArgumentParser( prog="python -m takeover.replay" )
+    parser.add_argument( "path" )
+    parser.add_argument( "--turn", type=int, default=None,
+                         help="default: the last turn recorded" )
+    args = parser.parse_args( argv )
+
+    try:
+        log = load( args.path )
+        turn = log.end if args.turn is None else args.turn
+
+        start = time.perf_counter()
+        game = log.game_at( turn )
+        elapsed = time.perf_counter() - start
+    except ( ReplayError, snapshot.SnapshotError ) as e:
+        parser.error( str( e ) )
+
+    print( "turn %d of %d (%d keyframes), re-simulated in %.3f s" %
+           ( turn, log.end, len(log.keyframes), elapsed ) )
+    for p in game.players:
+        print( "%-6s %3d planets %6d ships" % ( p.name, len(p.planets),
+                                                p.total_ships ) )
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit( main() )
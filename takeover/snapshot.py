@@ -0,0 +1,314 @@
+
+import array
+import collections
+import copy
+import json
+import math
+import mmap
+import struct
+import sys
+
+# if run as a script, pull from local directory
+# otherwise (if run as module), pull from package
+if __package__:
+    from . import gamelogic
+    from . import strategies
+else:
+    import gamelogic
+    import strategies
+
+# Snapshots of a gamelogic.Game: a compact, versioned binary format, to save
+# and restore games, to checkpoint long simulations, and to fork a game (for
+# instance, to look ahead).
+#
+# A snapshot holds all of the game state: planets, players (in particular,
+# the order of their planets: it decides the order of the AI's moves), the
+# fleets underway (in the order of the schedule's heap), and the state of
+# the random number streams. Restoring a snapshot gives a game that plays
+# on exactly as the original would have. Players' strategies are included
+# by name only (see strategies): restored games get new ones, with default
+# parameters. Not included: the observer, and the neighbor index (rebuilt
+# from the positions, or shared, see loads()).
+#
+# Layout (little-endian): header, game, strings, players (each followed by
+# the indices of its planets), then planets and fleets as columns (arrays),
+# and finally the random number streams.
+#
+# Usage:
+#   data = snapshot.dumps( game );  game = snapshot.loads( data )
+#   snapshot.save( game, path );    game = snapshot.load( path )
+#   other = snapshot.fork( game )
+
+MAGIC = b"TKOV"
+VERSION = 2         # 2: strategies
+
+HEADER = struct.Struct( "<4sH" )
+# turn, schedule seq, players, planets, fleets, autopilot, check, neighbors
+# (-1: None), radius (NaN: None)
+GAME = struct.Struct( "<qqIIIBBid" )
+# is_human, ratio, threshold, totals (ships, power, prod, strength), planets
+PLAYER = struct.Struct( "<Bdiiqdqdi" )
+# version, has gauss_next, gauss_next
+STREAM = struct.Struct( "<BBd" )
+LENGTH = struct.Struct( "<I" )
+
+# Columns of planets and fleets: ( array typecode, attribute )
+PLANETS = [ ( "d", "x" ), ( "d", "y" ), ( "q", "ships" ), ( "q", "prod" ),
+            ( "d", "strength" ), ( "i", "owner" ) ]
+FLEETS = [ ( "q", "arrival" ), ( "q", "seq" ), ( "i", "owner" ),
+           ( "i", "src" ), ( "i", "dst" ), ( "q", "ships" ),
+           ( "d", "strength" ), ( "q", "launched" ) ]
+
+SWAP = sys.byteorder == "big"
+
+
+class SnapshotError( Exception ):
+    pass
+
+
+# ------------------------------------------------------------
+
+class Writer:
+    def __init__( self ):
+        self.parts = []
+
+    def pack( self, st, *values ):
+        self.parts.append( st.pack( *values ) )
+
+    def array( self, code, values ):
+        a = array.array( code, values )
+        if SWAP:
+            a.byteswap()
+        self.parts.append( a.tobytes() )
+
+    def string( self, text ):
+        data = text.encode( "utf-8" )
+        self.parts.append( LENGTH.pack( len(data) ) )
+        self.parts.append( data )
+
+    def getvalue( self ):
+        return b"".join( self.parts )
+
+
+class Reader:
+    def __init__( self, data ):
+        self.data = data
+        self.pos = 0
+
+    def unpack( self, st ):
+        values = st.unpack_from( self.data, self.pos )
+        self.pos += st.size
+        return values
+
+    def array( self, code, n ):
+        a = array.array( code )
+        end = self.pos + n*a.itemsize
+        a.frombytes( self.data[ self.pos:end ] )
+        if SWAP:
+            a.byteswap()
+        self.pos = end
+        return a
+
+    def string( self ):
+        n, = self.unpack( LENGTH )
+        end = self.pos + n
+        text = bytes( self.data[ self.pos:end ] ).decode( "utf-8" )
+        self.pos = end
+        return text
+
+
+# ------------------------------------------------------------
+
+def dumps( game ):
+    w = Writer()
+    planets, players = game.planets, game.players
+    fleets = [ entry[2] for entry in game.schedule.heap ]
+
+    pidx = { p: i for i, p in enumerate( planets ) }
+    oidx = { o: i for i, o in enumerate( players ) }
+    oidx[ None ] = -1
+
+    w.pack( HEADER, MAGIC, VERSION )
+    w.pack( GAME, game.schedule.turn, game.schedule.seq, len(players),
+            len(planets), len(fleets), game.autopilot, game.check,
+            -1 if game.neighbors is None else game.neighbors,
+            math.nan if game.radius is None else game.radius )
+
+    battle = [ k for k, v in gamelogic.BATTLES.items() if v is game.battle ]
+    w.string( json.dumps( game.seed ) )
+    w.string( battle[0] )
+    w.string( game.dtype )
+    w.string( "\0".join( p.name for p in planets ) )
+    w.string( "\0".join( o.name for o in players ) )
+    w.string( "\0".join( o.strategy.name if o.strategy else strategies.CLASSIC
+                         for o in players ) )
+
+    for o in players:
+        w.pack( PLAYER, o.is_human(), o.ratio, o.threshold[0], o.threshold[1],
+                o.total_ships, o.total_power, o.total_prod, o.total_strength,
+                len(o.planets) )
+        w.array( "i", [ pidx[p] for p in o.planets ] )
+
+    w.array( "d", [ p.pos[0] for p in planets ] )
+    w.array( "d", [ p.pos[1] for p in planets ] )
+    w.array( "q", [ p.ships for p in planets ] )
+    w.array( "q", [ p.prod for p in planets ] )
+    w.array( "d", [ p.strength for p in planets ] )
+    w.array( "i", [ oidx[p.owner] for p in planets ] )
+
+    w.array( "q", [ entry[0] for entry in game.schedule.heap ] )
+    w.array( "q", [ entry[1] for entry in game.schedule.heap ] )
+    w.array( "i", [ oidx[f.owner] for f in fleets ] )
+    w.array( "i", [ pidx[f.src] for f in fleets ] )
+    w.array( "i", [ pidx[f.dst] for f in fleets ] )
+    w.array( "q", [ f.ships for f in fleets ] )
+    w.array( "d", [ f.strength for f in fleets ] )
+    w.array( "q", [ f.launched for f in fleets ] )
+
+    state = game.streams.getstate()
+    for name in gamelogic.Streams.names:
+        version, internal, gauss = state.pop( name )
+        w.pack( STREAM, version, gauss is not None,
+                0.0 if gauss is None else gauss )
+        w.array( "I", internal )
+    w.string( json.dumps( state ) )     # numpy generators, if any
+
+    return w.getvalue()
+
+
+# Distances: a neighbor index to share (it depends only on the positions,
+# and must have been built with the same parameters), instead of building
+# a new one. Its arrays are shared; it is copied to hand out the planets of
+# the new game.
+def loads( data, observer=None, distances=None ):
+    r = Reader( data )
+
+    magic, version = r.unpack( HEADER )
+    if magic != MAGIC:
+        raise SnapshotError( "Not a snapshot" )
+    if not 1 <= version <= VERSION:
+        raise SnapshotError( "Unsupported snapshot version %d" % version )
+
+    ( turn, seq, nplayers, nplanets, nfleets, autopilot, check,
+      neighbors, radius ) = r.unpack( GAME )
+    seed = json.loads( r.string() )
+    battle = r.string()
+    dtype = r.string()
+    planet_names = r.string().split( "\0" )
+    player_names = r.string().split( "\0" )
+    if version >= 2:
+        strategy_names = r.string().split( "\0" )
+    else:
+        strategy_names = [ strategies.CLASSIC ]*nplayers
+
+    # Built as Game.__init__() does, but without drawing random numbers
+    game = gamelogic.Game.__new__( gamelogic.Game )
+    game.streams = gamelogic.Streams( seed )
+    game.seed = seed
+    game.schedule = gamelogic.Schedule()
+    game.schedule.turn, game.schedule.seq = turn, seq
+    game.battle = gamelogic.BATTLES[ battle ]
+    game.observer = observer or gamelogic.Observer()
+    game.autopilot, game.check = bool( autopilot ), bool( check )
+    game.neighbors = None if neighbors < 0 else neighbors
+    game.radius = None if math.isnan( radius ) else radius
+    game.dtype = dtype
+
+    players, owned = [], []
+    for name in player_names[ :nplayers ]:
+        ( is_human, ratio, lo, hi, ships, power, prod, strength,
+          n ) = r.unpack( PLAYER )
+
+        o = gamelogic.Player.__new__( gamelogic.Player )
+        o.name = name
+        o.planets, o.fleets = {}, {}
+        o.targets = collections.Counter()
+        o.is_human_ = bool( is_human )
+        o.rng = game.streams.ai
+        o.schedule = game.schedule
+        o.ratio, o.threshold = ratio, ( lo, hi )
+        o.strategy = None
+        o.total_ships, o.total_power = ships, power
+        o.total_prod, o.total_strength = prod, strength
+
+        players.append( o )
+        owned.append( r.array( "i", n ) )
+    game.players = players
+
+    cols = [ r.array( code, nplanets ) for code, _ in PLANETS ]
+    planets = []
+    for i, ( x, y, ships, prod, strength, owner ) in enumerate( zip( *cols ) ):
+        p = gamelogic.Planet.__new__( gamelogic.Planet )
+        p.name = planet_names[i]
+        p.owner = players[owner] if owner >= 0 else None
+        p.pos = ( x, y )
+        p.idx = i
+        p.ships_ = ships
+        p.prod, p.strength = prod, strength
+        planets.append( p )
+    game.planets = planets
+
+    for o, idx in zip( players, owned ):
+        for i in idx:
+            o.planets[ planets[i] ] = 1
+
+    cols = [ r.array( code, nfleets ) for code, _ in FLEETS ]
+    heap = []
+    for arrival, s, owner, src, dst, ships, strength, launched in zip( *cols ):
+        f = gamelogic.Fleet.__new__( gamelogic.Fleet )
+        f.owner, f.src, f.dst = players[owner], planets[src], planets[dst]
+        f.ships, f.strength = ships, strength
+        f.schedule = game.schedule
+        f.launched, f.arrival = launched, arrival
+        f.velocity, _ = gamelogic.course( f.src.pos, f.dst.pos )
+
+        heap.append( ( arrival, s, f ) )
+    game.schedule.heap = heap
+
+    # Fleets of each player, in launch order (as they were added)
+    for _, _, f in sorted( heap, key=lambda entry: entry[1] ):
+        f.owner.fleets[f] = 1
+        f.owner.targets[f.dst] += 1
+
+    state = {}
+    for name in gamelogic.Streams.names:
+        version, has_gauss, gauss = r.unpack( STREAM )
+        internal = tuple( r.array( "I", 625 ) )
+        state[ name ] = ( version, internal, gauss if has_gauss else None )
+    state.update( json.loads( r.string() ) )
+    game.streams.setstate( state )
+
+    if distances is None:
+        distances = gamelogic.neighbor_index( [ p.pos for p in planets ],
+                                              planets, game.neighbors,
+                                              game.radius, dtype )
+    else:
+        distances = copy.copy( distances )
+        distances.items = planets
+    game.distances = distances
+    for p in planets:
+        p.distances = distances
+
+    for o, name in zip( players, strategy_names ):
+        o.strategy = strategies.make( name, game )
+
+    game.observer.game_started( game )
+    return game
+
+
+def save( game, path ):
+    with open( path, "wb" ) as f:
+        f.write( dumps( game ) )
+
+# With use_mmap, the file is mapped into memory rather than read
+def load( path, observer=None, use_mmap=False ):
+    with open( path, "rb" ) as f:
+        if not use_mmap:
+            return loads( f.read(), observer )
+        with mmap.mmap( f.fileno(), 0, access=mmap.ACCESS_READ ) as m:
+            return loads( m, observer )
+
+# An independent copy of the game, without observer. It shares the neighbor
+# index (which never changes) with the original.
+def fork( game, observer=None ):
+    return loads( dumps( game ), observer, game.distances )
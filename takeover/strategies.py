@@ -0,0 +1,351 @@
+
+import importlib
+import weakref
+
+# if run as a script, pull from local directory
+# otherwise (if run as module), pull from package
+if __package__:
+    from . import gamelogic
+else:
+    import gamelogic
+
+# Strategies: AIs that can be plugged in, for any player (human included,
+# with autopilot), in place of the built-in AI (gamelogic.Player.make_move).
+#
+# A strategy sees the galaxy as arrays (see Galaxy), read-only, and returns
+# the launches it wants to make, as a list of ( src, dst, ships ), with
+# planets by index. The game checks and makes the launches. Subclasses of
+# Strategy implement moves(); the rest is done here:
+#
+#   class Cautious( strategies.Strategy ):
+#       name = "cautious"
+#       def moves( self, galaxy, me ):
+#           return []
+#   strategies.register( Cautious )
+#
+#   game.players[i].strategy = strategies.make( "cautious", game )
+#
+# Strategies are known by name (for the UI, the command line, snapshots);
+# "classic" is the built-in AI; opponents play "batched" (its rules, made
+# for all planets at once, see Batched) unless chosen otherwise. Plugins
+# register themselves when imported; those that come with the game are
+# listed by name (see PLUGINS), and only imported once a strategy of theirs
+# is made.
+#
+# Requires numpy (Galaxy); without it, only the built-in AI is available
+# (and plays for "batched", see takeover).
+# Random numbers come from the game's ai stream (as a numpy Generator), so
+# games with strategies can be replayed like any other.
+
+CLASSIC = "classic"
+BATCHED = "batched"             # the opponents' AI, by default
+
+STRATEGIES = {}                 # name -> Strategy subclass
+PLUGINS = { "lookahead": "lookahead" }   # name -> module, with the game
+
+
+class StrategyError( Exception ):
+    pass
+
+
+# The galaxy, as seen by strategies: arrays, one entry per planet, indexed
+# like game.planets. All arrays are read-only (numpy writeable flag off).
+# - pos: positions, shape (n, 2)
+# - ships, prod, strength
+# - owner: index of the owning player, -1 for neutral planets
+# Also, by method: targets( i ), the planets player i has fleets heading
+# for; owned( i ), the planets of player i, in the order acquired;
+# nearest( k ), the k nearest neighbors of every planet.
+#
+# For gamelogic.Game, the arrays are collected from the planets, whenever
+# the game has moved on (a turn or a launch) since the last time; for
+# arraygame.ArrayGame, they are views of the game's own arrays. The galaxy
+# only holds a weak reference to the game.
+class Galaxy:
+    def __init__( self, game ):
+        np = gamelogic.numpy()
+        if np is None:
+            raise ImportError( "strategies require numpy" )
+
+        self.game = weakref.proxy( game )
+        self.objects = isinstance( game, gamelogic.Game )
+        self.key = None
+        self.neighbors = {}       # k -> ( near, dist )
+
+        planets = game.planets
+        n = len( planets )
+        if self.objects:
+            self.pos = frozen( np.array( [ p.pos for p in planets ],
+                                         dtype=float ).reshape( n, 2 ) )
+            self.prod = frozen( np.fromiter( ( p.prod for p in planets ),
+                                             np.int64, n ) )
+            self.strength = frozen( np.fromiter( ( p.strength
+                                                   for p in planets ),
+                                                 float, n ) )
+            self.update()
+        else:
+            self.pos = frozen( game.planet_pos.view() )
+            self.prod = frozen( game.prod.view() )
+            self.strength = frozen( game.strength.view() )
+            self.ships = frozen( game.ships.view() )
+            self.owner = frozen( game.owner.view() )
+
+    def __len__( self ):
+        return len( self.prod )
+
+    # Brings ships and owners up to date (objects only)
+    def update( self ):
+        if not self.objects:
+            return
+
+        game = self.game
+        key = ( game.schedule.turn, game.schedule.seq )
+        if key == self.key:
+            return
+        self.key = key
+
+        np = gamelogic.numpy()
+        planets = game.planets
+        idx = { o: i for i, o in enumerate( game.players ) }
+        idx[ None ] = -1
+        self.ships = frozen( np.fromiter( ( p.ships_ for p in planets ),
+                                          np.int64, len(planets) ) )
+        self.owner = frozen( np.fromiter( ( idx[p.owner] for p in planets ),
+                                          np.int32, len(planets) ) )
+
+    # Boolean array: the planets player i has fleets heading for
+    def targets( self, i ):
+        np = gamelogic.numpy()
+        game = self.game
+
+        targets = np.zeros( len(self), dtype=bool )
+        if self.objects:
+            dst = [ p.idx for p in game.players[i].targets ]
+        else:
+            dst = game.fleet_dst[ game.alive & ( game.fleet_owner == i ) ]
+        targets[ dst ] = True
+        return targets
+
+    # Array of the planets player i owns, by index, in the order acquired
+    # (as the built-in AI goes through them)
+    def owned( self, i ):
+        np = gamelogic.numpy()
+        game = self.game
+
+        if self.objects:
+            return np.fromiter( ( p.idx for p in game.players[i].planets ),
+                                np.intp )
+        return game.owned( i )
+
+    # The k nearest neighbors of each planet, and their distances, as
+    # arrays of shape (n, k+1): column 0 is the planet itself. Only planets
+    # in the game's neighbor index count (see gamelogic.neighbor_index());
+    # rows with fewer are padded with the planet itself.
+    def nearest( self, k ):
+        if k in self.neighbors:
+            return self.neighbors[ k ]
+
+        np = gamelogic.numpy()
+        n = len( self )
+        cols = min( k+1, n )
+
+        order = self.game.distances.order
+        if isinstance( order, np.ndarray ):
+            near = np.array( order[ :, :cols ], dtype=np.intp )
+        else:
+            near = np.repeat( np.arange( n )[ :, None ], cols, axis=1 )
+            for i, row in enumerate( order ):
+                row = row[ :cols ]
+                near[ i, :len(row) ] = row
+
+        d = self.pos[ near ] - self.pos[ :, None ]
+        dist = np.hypot( d[ ..., 0 ], d[ ..., 1 ] )
+
+        self.neighbors[ k ] = ( frozen( near ), frozen( dist ) )
+        return self.neighbors[ k ]
+
+
+def frozen( a ):
+    a.flags.writeable = False
+    return a
+
+
+# One galaxy per game, shared by all of its strategies; dropped with the game
+galaxies = weakref.WeakKeyDictionary()
+
+def galaxy( game ):
+    g = galaxies.get( game )
+    if g is None:
+        g = galaxies[ game ] = Galaxy( game )
+    g.update()
+    return g
+
+
+# ------------------------------------------------------------
+
+# Base class of all strategies. Strategies belong to a game; make_move() is
+# called by the game (see gamelogic.Player.strategy), and calls moves().
+class Strategy:
+    name = None
+
+    def __init__( self, game ):
+        if gamelogic.numpy() is None:
+            raise ImportError( "strategies require numpy" )
+        self.game = game
+
+    # The launches to make: [ ( src, dst, ships ) ], planets by index
+    def moves( self, galaxy, me ):
+        raise NotImplementedError
+
+    # Random numbers, as a numpy Generator (from the game's ai stream)
+    @property
+    def rng( self ):
+        return self.game.streams.generator( "ai" )
+
+    # Returns the list of fleets launched
+    def make_move( self, player, planets ):
+        me = self.game.players.index( player )
+
+        launched = []
+        for src, dst, ships in self.moves( galaxy( self.game ), me ):
+            src, dst, ships = planets[src], planets[dst], int( ships )
+            if src.owner is not player or not 0 < ships <= src.ships:
+                raise StrategyError( "%s: can't launch %d ships from %s" %
+                                     ( self.name, ships, src.name ) )
+            launched.append( player.launch_fleet( src, dst, ships ) )
+        return launched
+
+
+def register( cls ):
+    STRATEGIES[ cls.name ] = cls
+    return cls
+
+# Names of all strategies, the built-in AI first; plugins aren't imported
+def available():
+    return [ CLASSIC ] + sorted( set( STRATEGIES ) | set( PLUGINS ) )
+
+# A new strategy for the game; None for the built-in AI
+def make( name, game ):
+    if name == CLASSIC:
+        return None
+    if name not in STRATEGIES and name in PLUGINS:
+        if __package__:
+            importlib.import_module( "." + PLUGINS[ name ], __package__ )
+        else:
+            importlib.import_module( PLUGINS[ name ] )
+    if name not in STRATEGIES:
+        raise StrategyError( "Unknown strategy: %s" % name )
+    return STRATEGIES[ name ]( game )
+
+
+# ------------------------------------------------------------
+
+# The built-in AI's rules (see gamelogic.Player.make_move), batched: each
+# planet of the player's goes through its neighbors, nearest first, other
+# than its own; it stops once ratio of its ships is below the threshold's
+# low end, skips the neighbor unless ratio of its ships is at least a random
+# threshold (drawn per neighbor) and more than the neighbor's ships, and
+# unless the player attacks it already; else it attacks with ratio of its
+# ships, and goes on with the rest.
+#
+# The thresholds are drawn for all pairs ( planet, neighbor ) at once, and
+# the pairs that qualify with the planets' ships before any launch are
+# picked out in one pass. A launch only makes the rules harder to meet
+# (fewer ships, more planets attacked), so only those pairs are checked
+# again, in order, as launches are made. The draws come from the ai stream
+# (a numpy Generator), not from the built-in AI's random.Random: same
+# rules, but not the same moves.
+class Batched( Strategy ):
+    name = BATCHED
+
+    def moves( self, galaxy, me ):
+        np = gamelogic.numpy()
+        player = self.game.players[me]
+        ratio, ( lo, hi ) = player.ratio, player.threshold
+        ships, owner = galaxy.ships, galaxy.owner
+
+        src = galaxy.owned( me )
+        src = src[ ratio*ships[src] >= lo ]
+        if len( src ) == 0:
+            return []
+
+        # All pairs ( planet, neighbor ): shape (planets, neighbors)
+        near, _ = galaxy.nearest( len( galaxy ) )
+        dst = near[ src ]
+        send = ratio*ships[ src, None ]
+        draws = self.rng.integers( lo, hi, dst.shape, endpoint=True )
+        ok = ( ( owner[dst] != me ) & ~galaxy.targets( me )[dst] &
+               ( draws <= send ) & ( ships[dst] < send ) )
+
+        rows, _ = np.nonzero( ok )
+        left = dict( zip( src.tolist(), ships[ src ].tolist() ) )
+        defending = ships.tolist()
+        targets = set()
+        launched = []
+        for p, q, draw in zip( src[ rows ].tolist(), dst[ ok ].tolist(),
+                               draws[ ok ].tolist() ):
+            send = ratio*left[p]
+            if ( send < lo or send < draw or q in targets or
+                 defending[q] >= send ):
+                continue
+            launched.append( ( p, q, int( send ) ) )
+            left[p] -= int( send )
+            targets.add( q )
+        return launched
+
+register( Batched )
+
+
+# The built-in AI's idea, for all planets at once: each planet of the
+# player's with enough ships (ratio of its ships, at least a random
+# threshold) attacks one of its nearest neighbors, if weaker and not yet
+# under attack by the player. All pairs of planets and neighbors are scored
+# at once: production gained, per ship defending it and per distance. Each
+# planet picks its best target; each target is attacked from the planet
+# that scores it best.
+#
+# Unlike the built-in AI, a planet launches at most one fleet per turn; and
+# the threshold is drawn once per planet, not once per neighbor.
+class Greedy( Strategy ):
+    name = "greedy"
+
+    def __init__( self, game, k=16 ):
+        super().__init__( game )
+        self.k = k
+
+    def moves( self, galaxy, me ):
+        np = gamelogic.numpy()
+        player = self.game.players[me]
+        ratio, ( lo, hi ) = player.ratio, player.threshold
+        ships, owner = galaxy.ships, galaxy.owner
+
+        src = np.flatnonzero( owner == me )
+        send = ratio*ships[src]
+        keep = send >= self.rng.integers( lo, hi, len(src), endpoint=True )
+        src, send = src[keep], send[keep]
+        if len( src ) == 0:
+            return []
+
+        # All pairs ( source, neighbor ): shape (sources, k+1)
+        near, dist = galaxy.nearest( self.k )
+        dst, d = near[src], dist[src]
+        ok = ( ( owner[dst] != me ) & ~galaxy.targets( me )[dst] &
+               ( ships[dst] < send[ :, None ] ) )
+        score = np.where( ok, galaxy.prod[dst]/( ( 1.0 + ships[dst] )*
+                                                 ( 1.0 + d ) ), -np.inf )
+
+        best = score.argmax( axis=1 )
+        rows = np.arange( len(src) )
+        score, dst = score[ rows, best ], dst[ rows, best ]
+        ok = np.isfinite( score )
+        src, dst, send, score = src[ok], dst[ok], send[ok], score[ok]
+
+        # One attack per target: the best scoring one
+        order = np.argsort( -score, kind="stable" )
+        _, first = np.unique( dst[order], return_index=True )
+        pick = np.sort( order[first] )
+
+        return list( zip( src[pick].tolist(), dst[pick].tolist(),
+                          send[pick].astype( np.int64 ).tolist() ) )
+
+register( Greedy )
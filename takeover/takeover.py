@@ -1,22 +1,88 @@
 
+import argparse
+import importlib
+import math
 import random
+import time
 
 import pyglet
 
 # if run as a script, pull from local directory
 # otherwise (if run as module), pull from package
-if __name__ == "__main__":
-    import utils
-    import gamelogic
-else:
+# (by package, not by __name__: the worker process re-imports the main
+# module under another name, see worker)
+if __package__:
     from . import utils
     from . import gamelogic
+    from . import strategies
     # import takeover.utils as utils
     # import takeover.gamelogic as gamelogic
+else:
+    import utils
+    import gamelogic
+    import strategies
     
     
+# The modules only the game needs (maps, replay, timers, worker) are
+# imported when it starts, or when a hotkey needs them, not with the splash
+# screen: by name, from the package (or the local directory, see above)
+def load( name ):
+    if __package__:
+        return importlib.import_module( "." + name, __package__ )
+    return importlib.import_module( name )
+
+
+# Everything the game needs, loaded ahead of time (while the splash screen
+# is shown), see utils.Preloader. Images go into a common atlas.
+def game_assets():
+    assets = utils.Preloader()
+    atlas = utils.Atlas()
+
+    assets.add( "numpy", gamelogic.numpy )
+    for name in [ "maps", "replay", "worker" ]:
+        assets.add( name, lambda name=name: load( name ) )
+    assets.add( "atlas", lambda: atlas )
+    assets.add( "background", lambda: pyglet.resource.texture(
+        "background-640x640.png" ) )
+
+    names = [ "panel2.png", "metal-bar-320x40.png", "metal-knob-36x36.png",
+              "icons8-viper-mark-2-24.png", "explosion.png", "expanding.png" ]
+    names += [ "planets/planet%02d.png" % k for k in range( 1, 18 ) ]
+    for name in names:
+        assets.add( name, lambda name=name: atlas.image( name ) )
+
+    assets.add( "help", lambda: pyglet.resource.text( "help.txt" ) )
+    assets.add( "names", load_names )
+
+    return assets
+
+# Names should be not more than 7 chars!
+def load_names():
+    names = []
+    for line in pyglet.resource.text( "names.txt" ).text.split( "\n" ):
+        if line:
+            name = line.strip()
+            names.append( name )
+    return names
+
+
+# Opponents to choose from, on the splash screen
+MAX_OPPONENTS = 10
+
+# Is ( x, y ) on the (centered) label?
+def hit( label, x, y ):
+    return ( abs( x - label.x ) < label.content_width//2 and
+             label.y - 5 < y < label.y + label.content_height )
+
+
+# The opponents' AI (by default, the built-in AI's rules, batched: see
+# strategies.Batched): one strategy for all (click the label to change it),
+# and others for some of them, by index (click an opponent's entry below
+# the label, or see main). Auto-play and autopilot are passed on to the
+# game (see GameController).
 class SplashController( utils.Controller ):
-    def __init__( self, win ):
+    def __init__( self, win, ai=strategies.BATCHED, overrides=None,
+                  autoplay=None, autopilot=False ):
         self.window = win
         self.frame = utils.Frame( win )
         self.batch = pyglet.graphics.Batch()
@@ -43,11 +109,30 @@ class SplashController( utils.Controller ):
                                             batch=self.batch )
         self.slider2 = utils.LabeledSlider( 580, 80, bar, knob, edge=0,
                                             batch=self.batch )
-        self.slider1.update( "Opponents", 5, 1, 10 )
+        self.slider1.update( "Opponents", 5, 1, MAX_OPPONENTS )
         self.slider2.update( "Neutral Planets", 7, 1, 12 )
         
         self.frame.add_widget( self.slider1 )
         self.frame.add_widget( self.slider2 )        
+
+
+        # --- AI
+        # One entry per opponent (as many as the slider is set to), in the
+        # color of the label unless overridden
+        self.ai = ai
+        self.overrides = dict( overrides or {} )
+        self.ai_label = pyglet.text.Label( "", x=win.width//2, y=32,
+                                           anchor_x="center",
+                                           color=(0,255,0,255), font_size=12,
+                                           batch=self.batch )
+        self.ai_entries = []
+        for i in range( MAX_OPPONENTS ):
+            self.ai_entries.append( pyglet.text.Label( "", y=10,
+                                                       anchor_x="center",
+                                                       font_size=8,
+                                                       batch=self.batch ) )
+        self.shown = None         # number of entries shown
+        self.show_ai()
        
 
         # --- Button
@@ -68,12 +153,69 @@ class SplashController( utils.Controller ):
             self.frame.remove_widget( self.slider2 )
             self.batch.invalidate()
             self.window.pop_handlers() # This pops the frame!
+            opponents = self.slider1.result
+            ai = [ self.overrides.get( i, self.ai )
+                   for i in range( opponents ) ]
+            # Without numpy, the built-in AI plays by the same rules
+            if self.assets[ "numpy" ] is None:
+                ai = [ strategies.CLASSIC if name == strategies.BATCHED
+                       else name for name in ai ]
             self.window.set_controller( GameController(self.window,
-                                                       self.slider1.result,
-                                                       self.slider2.result) )
+                                                       opponents,
+                                                       self.slider2.result,
+                                                       self.assets, ai,
+                                                       autoplay,
+                                                       autopilot) )
         self.button.on_click = clicked
+
+        # Load the game while the splash screen is up
+        self.assets = game_assets()
+        self.assets.start()
+
+    def show_ai( self ):
+        self.ai_label.text = "Opponents' AI: %s" % self.ai
+
+        n = self.slider1.result
+        for i, entry in enumerate( self.ai_entries ):
+            entry.text = "AI%d: %s" % ( i, self.overrides.get( i, self.ai ) )
+            entry.color = (255,255,0,255) if i in self.overrides else \
+                          (0,255,0,255)
+            entry.x = self.window.width//2 + int( ( i - (n-1)/2 )*90 )
+            entry.visible = i < n
+        self.shown = n
+
+    # Clicking the AI label selects the next strategy for all opponents;
+    # clicking an opponent's entry, the next one for that opponent only
+    # (back to the label's: no override). The built-in AI only, without
+    # numpy.
+    def on_mouse_press( self, x, y, but, mod ):
+        names = [ strategies.CLASSIC ]
+        if self.assets[ "numpy" ] is not None:
+            names = strategies.available()
+
+        def after( name ):
+            k = names.index( name ) if name in names else -1
+            return names[ (k+1) % len(names) ]
+
+        if hit( self.ai_label, x, y ):
+            self.ai = after( self.ai )
+        else:
+            for i, entry in enumerate( self.ai_entries[ :self.shown ] ):
+                if hit( entry, x, y ):
+                    name = after( self.overrides.get( i, self.ai ) )
+                    if name == self.ai:
+                        self.overrides.pop( i, None )
+                    else:
+                        self.overrides[i] = name
+                    break
+            else:
+                return
+        self.show_ai()
         
     def draw( self ):        
+        if self.slider1.result != self.shown:
+            self.show_ai()
+
         self.window.clear()
         self.bg.draw()
         self.splash.blit( 0, 0 )
@@ -99,37 +241,147 @@ PlanetButton.register_event_type( "on_dn" )
 PlanetButton.register_event_type( "on_up" )
 
 
+# Keeps the UI in sync with the gamelogic: planet buttons, fleet sprites,
+# battle and support animations, and the two tables.
+# Only the human's fleets are shown while underway.
+#
+# Sprites come from pools (utils.SpritePool), one for each kind of sprite.
+class GameView( gamelogic.Observer ):
+    def __init__( self, buttons, table1, table2, fleets, battles, supports ):
+        self.buttons = buttons
+        self.table1, self.table2 = table1, table2
+
+        self.fleets = fleets
+        self.battles = battles
+        self.supports = supports
+
+        self.offset = 15          # half planet width!
+        self.sprites = {}         # fleet -> sprite
+
+    def game_started( self, game ):
+        # A game may replace another one (see replay): start over with the
+        # fleets underway
+        for sprite in self.sprites.values():
+            self.fleets.release( sprite )
+        self.sprites = {}
+        for fleet in game.players[0].fleets:
+            self.fleet_launched( fleet )
+
+        # Update UI planets with position info; grab the names from UI buttons
+        for i in range( len(game.planets) ):
+            self.buttons[i].x = game.planets[i].pos[0]
+            self.buttons[i].y = game.planets[i].pos[1]
+
+            game.planets[i].name = self.buttons[i].name
+
+            # print( game.planets[i].name, game.planets[i].pos )
+
+        self.turn_finished( game )
+
+    def fleet_launched( self, fleet ):
+        if not fleet.owner.is_human():
+            return
+
+        phi = 180*math.atan2( fleet.velocity[0], fleet.velocity[1] )/math.pi
+        self.sprites[ fleet ] = self.fleets.acquire( fleet.pos[0]+self.offset,
+                                                     fleet.pos[1]+self.offset,
+                                                     rotation=phi )
+
+    def fleet_arrived( self, fleet, is_support ):
+        if fleet in self.sprites:
+            self.fleets.release( self.sprites.pop( fleet ) )
+        self.show_arrival( fleet.dst, is_support )
+
+    def show_arrival( self, planet, is_support ):
+        # offset: 15=half planet width; 24=half explosion width
+        # (effects release themselves when done)
+        x = planet.pos[0] + self.offset - 24
+        y = planet.pos[1] + self.offset - 24
+        if is_support:
+            self.supports.acquire( x, y )
+        else:
+            self.battles.acquire( x, y )
+
+    def turn_finished( self, game ):
+        for fleet, sprite in self.sprites.items():
+            sprite.update( x=fleet.pos[0]+self.offset,
+                           y=fleet.pos[1]+self.offset )
+
+        # pass info to display - remember: room for header line!
+        # (Only cells whose text changed are touched.)
+        self.table1.set_rows( 1, [ p.stats() for p in game.players ] )
+        self.table2.set_rows( 1, [ p.stats() for p in game.planets ] )
+
+
+# Trace track of the events timed in the worker (see timers.Timers.merge())
+WORKER_TRACK = 1
+
+# Turns per sec for auto-play; 0: as fast as possible
+RATES = [ 1, 2, 5, 10, 20, 50, 0 ]
+
+# Assets: see game_assets(); if not given, they are loaded here and now.
+# AI: the name of each opponent's strategy (default: the built-in AI).
+# Autoplay: start with auto-play on, at that rate (see RATES); autopilot:
+# the AI plays for the human as well.
 class GameController( utils.Controller ):
-    def __init__( self, win, opponents, planets ):
+    def __init__( self, win, opponents, planets, assets=None, ai=None,
+                  autoplay=None, autopilot=False ):
         self.window = win
         self.frame = utils.Frame( self.window )
         self.batch = pyglet.graphics.Batch()
+        self.panel = pyglet.graphics.Batch()   # static: never changes
 
+        bg_grp = pyglet.graphics.Group(-1)
         planet_grp = pyglet.graphics.Group(0)
         fleets_grp = pyglet.graphics.Group(1)
         effect_grp = pyglet.graphics.Group(2)
 
         self.over = None
 
-        metal = pyglet.resource.image( "panel2.png" )
+        # All game images share one texture atlas; except the background,
+        # which is a texture of its own
+        if assets is None:
+            assets = game_assets()
+        assets.finish()
+        self.atlas = assets[ "atlas" ]
+
+        # Background: scrolls down, 10 pixels per sec
+        self.bg = assets[ "background" ]
+        self.background = utils.ScrollingBackground( self.bg, 10,
+                                                     batch=self.batch,
+                                                     group=bg_grp )
+
+        pyglet.clock.schedule_interval( self.background.scroll, 1/60. )
+
+        # Side panel
+        w = self.window.width - self.bg.width - 1
+        self.panel_bg = pyglet.shapes.Rectangle( self.bg.width+1, 0,
+                                                 w, self.window.height,
+                                                 color=(223,224,228),
+                                                 batch=self.panel,
+                                                 group=pyglet.graphics.Group(0) )
+        metal = self.atlas.image( "panel2.png" )
         # metal = pyglet.resource.image( "panel5.png" )
         # metal = pyglet.resource.image( "panel4.png" )
-        self.metal = pyglet.sprite.Sprite( metal, x=640, y=0 )
+        self.metal = pyglet.sprite.Sprite( metal, x=self.bg.width, y=0,
+                                           batch=self.panel,
+                                           group=pyglet.graphics.Group(1) )
 
         
         # Slider
         self.slider = None
-        self.bar = pyglet.resource.image( "metal-bar-320x40.png" )
-        self.knob = pyglet.resource.image( "metal-knob-36x36.png" )        
+        self.bar = self.atlas.image( "metal-bar-320x40.png" )
+        self.knob = self.atlas.image( "metal-knob-36x36.png" )
         
         
-        # Background
-        self.bg = pyglet.resource.image( "background-640x640.png" )
-        self.upp = pyglet.sprite.Sprite( self.bg, batch=self.batch )
-        self.low = pyglet.sprite.Sprite( self.bg, batch=self.batch )
-        self.seam = 0
+        # Frame rate overlay, toggled by F2
+        self.frame_stats = None
 
-        pyglet.clock.schedule_interval(self.scroll_background, 1/60.)
+        # Timers for the phases of a turn and of a frame, toggled by F3;
+        # F4 writes the trace so far to a file (see timers.Timers). Turns
+        # are timed in the worker, and show up on a track of their own.
+        self.timers = None
+        self.timers_overlay = None
         
         
         # Opponent Table
@@ -145,17 +397,23 @@ class GameController( utils.Controller ):
 
         # Planet Table
         # name, owner, ships, prod, strength
-        rows = 1 + 1 + opponents + planets # hdr + human + opps + neutral
-        self.table2 = utils.TextTable( rows, 15, [60,55,40,35,55,45],
-                                       background=(220,220,220), fontsize=10 )
+        # Shows as many rows as fit below the opponent table and the help
+        # text; scroll (mouse wheel) for the others.
+        lines = 1 + 1 + opponents + planets # hdr + human + opps + neutral
+        fit = ( self.window.height - 15*(opponents+2) - 10 - 90 - 30 )//15
+        self.table2 = utils.ScrollingTable( lines, fit-1, 15,
+                                            [60,55,40,35,55,45],
+                                            background=(220,220,220),
+                                            fontsize=10 )
         self.table2.set_position( 10+self.bg.width, 10 - 1 )
+        rows = 1 + self.table2.visible
         hdr = [ "Name", "Owner", "Ships", "Prod", "Strngth", "Value" ]
         for row, h in enumerate(hdr):
             self.table2.set_attr( 0, row, text=h, bold=True, size=8 )
 
 
         # Instructions
-        doc = pyglet.resource.text( "help.txt" )
+        doc = assets[ "help" ]
         doc.set_style( 0, 0, { "color": (0,255,0,255), "font_size": 10 } )
         self.layout = pyglet.text.layout.TextLayout( doc, 300, 90,
                                                      multiline=True,
@@ -169,63 +427,29 @@ class GameController( utils.Controller ):
                 
         # Fleets
         # fleet_img = pyglet.resource.image( "icons8-launch-30.png" )
-        fleet_img = pyglet.resource.image( "icons8-viper-mark-2-24.png" )
+        fleet_img = self.atlas.image( "icons8-viper-mark-2-24.png" )
         fleet_img.anchor_x = fleet_img.width//2
         fleet_img.anchor_y = fleet_img.height//2
-        self.fleets = {}
-
-        def fleet_maker():
-            fleet = pyglet.sprite.Sprite( fleet_img, batch=self.batch,
-                                          group=fleets_grp )
-            self.fleets[ fleet ] = 1
-            def f():
-                del self.fleets[fleet] # self is the game obj!
-                fleet.delete()
-            fleet.remove = f
-            return fleet
+        self.fleets = utils.SpritePool( fleet_img, self.batch, fleets_grp )
 
         
         # Battles
-        tmp = pyglet.image.ImageGrid( pyglet.resource.image("explosion.png"),
+        tmp = pyglet.image.ImageGrid( self.atlas.image("explosion.png"),
                                       1, 15 )
         tmp = pyglet.image.Animation.from_image_sequence( tmp,
                                                           duration=0.1,
                                                           loop=False )
         
-        battle_img = tmp
-        self.battles = {}
-        
-        def battle_maker( x, y ):
-            battle = pyglet.sprite.Sprite( battle_img, x=x, y=y,
-                                           batch=self.batch,
-                                           group=effect_grp )
-            self.battles[ battle ] = 1
-            def f():
-                del self.battles[battle]
-                battle.delete()
-            battle.on_animation_end = f  # sprite removes itself when done!
-            return battle
+        self.battles = utils.SpritePool( tmp, self.batch, effect_grp )
 
 
         # Reinforcements
-        tmp = pyglet.image.ImageGrid( pyglet.resource.image("expanding.png"),
+        tmp = pyglet.image.ImageGrid( self.atlas.image("expanding.png"),
                                       1, 8 )
         tmp = pyglet.image.Animation.from_image_sequence( tmp,
                                                           duration=0.1,
                                                           loop=False )
-        support_img = tmp
-        self.supports = {}
-        
-        def support_maker( x, y ):
-            support = pyglet.sprite.Sprite( support_img, x=x, y=y,
-                                           batch=self.batch,
-                                           group=effect_grp )
-            self.supports[ support ] = 1
-            def f():
-                del self.supports[ support ]
-                support.delete()
-            support.on_animation_end = f  # sprite removes itself when done!
-            return support
+        self.supports = utils.SpritePool( tmp, self.batch, effect_grp )
         
         
         # Planets
@@ -234,23 +458,22 @@ class GameController( utils.Controller ):
         # a separate existence from the gamelogic Planets. All possible
         # PlanetButtons are created at once and kept; it's up to gamelogic
         # to place the required number on the screen (the rest is not shown)
-        # Names should be not more than 7 chars!
-        names = []
-        for line in pyglet.resource.text( "names.txt" ).text.split( "\n" ):
-            if line:
-                name = line.strip()
-                names.append( name )
+        # Names should be not more than 7 chars! If there are more planets
+        # than names, names are reused with a number.
+        names = list( assets[ "names" ] )
         random.shuffle( names )
         
         self.planets = []        
-        for i in range(0,26):
+        for i in range( planets + opponents + 1 ):
             k = 1 + i%17
-            planet_img = pyglet.resource.image( "planets/planet%02d.png"%k )
+            planet_img = self.atlas.image( "planets/planet%02d.png"%k )
             but = PlanetButton( i, planet_img, self.batch, planet_grp )
             but.set_scale( 0.1 )
 
             # Monkey patch the name onto the planet
-            but.name = names[i]
+            but.name = names[ i%len(names) ]
+            if i >= len(names):
+                but.name = but.name[:4] + "-%d" % (i//len(names) + 1)
 
             # capture crr val of i, with room for header
             def f( i=i+1 ): self.table2.highlight(i) 
@@ -260,9 +483,6 @@ class GameController( utils.Controller ):
             
             self.planets.append( but )
             self.frame.add_widget( but )
-            
-            if len(self.planets) == planets + opponents + 1:
-                break
 
             
         # Drag-n-Drop 
@@ -270,22 +490,56 @@ class GameController( utils.Controller ):
         self.src, self.dst = None, None
 
 
-        # Load a set of non-overlapping random positions,
-        # generated using Bridson's Blue Noise algo
-        positions = []
-        for line in pyglet.resource.text( "positions.txt" ).text.split( "\n" ):
-            if line:
-                x, y = line.strip().split( "\t" )
-                positions.append( (float(x), float(y)) )            
+        # A new map for each game: non-overlapping random positions,
+        # generated using Bridson's Blue Noise algo (see maps). The seed
+        # determines the map and the game.
+        self.seed = random.randrange( 2**32 )
+        positions = assets[ "maps" ].board_map( self.seed )
                 
                 
         # Finally, instantiate gamelogic, now that UI is all set up        
-        self.game = gamelogic.Game( opponents, planets, self.planets,
-                                    fleet_maker, battle_maker, support_maker,
-                                    positions, self.table1, self.table2 )
+        self.view = GameView( self.planets, self.table1, self.table2,
+                              self.fleets, self.battles, self.supports )
+        self.game = gamelogic.Game( opponents, planets, positions,
+                                    seed=self.seed, observer=self.view,
+                                    autopilot=autopilot )
+        for player, name in zip( self.game.players[1:], ai or [] ):
+            player.strategy = strategies.make( name, self.game )
+
+        # The game is recorded: LEFT and RIGHT go back and forth by a turn,
+        # F5 writes the replay to a file (see replay)
+        self.recorder = assets[ "replay" ].Recorder( self.game )
+
+        # Turns are resolved in the background (see worker), and picked up
+        # by collect(); until then, the game can't be changed (no launches,
+        # no seeking, no next turn), and "Resolving..." is shown
+        self.worker = assets[ "worker" ].TurnWorker()
+        self.submitted = None
+        self.resolving = pyglet.text.Label( "Resolving...", x=640//2, y=10,
+                                            anchor_x="center",
+                                            color=(0,255,0,255),
+                                            font_size=12 )
+
+        # Auto-play, toggled by A: turns advance by themselves, at a rate
+        # chosen by + and -. At the top rate ("max"), turns are resolved
+        # in batches, as many as fit into a frame or two, and only the last
+        # turn of each batch is drawn. The rate sustained is shown.
+        self.rate = autoplay if autoplay is not None else 5
+        self.auto = None          # [ start, turns ], while on
+        self.due = 0.0            # turns due, see auto_turn()
+        self.auto_label = pyglet.text.Label( "", x=10, y=10,
+                                             color=(0,255,0,255),
+                                             font_size=10 )
+        if autoplay is not None:
+            self.start_auto()
+
+        # Notices (files written), shown for a few secs, see notify()
+        self.notice = pyglet.text.Label( "", x=640//2, y=self.window.height-20,
+                                         anchor_x="center",
+                                         color=(0,255,0,255), font_size=10 )
         
     def on_dn( self, x, y, i ):
-        if self.slider:
+        if self.slider or self.worker.busy:
             return
         
         # only do if owned by human!
@@ -297,6 +551,8 @@ class GameController( utils.Controller ):
                                           batch=self.batch )
         self.src = i
         
+    # A drag across a turn in flight is dropped: the game it began in is
+    # about to be replaced
     def on_up( self, x, y, i ):
         if self.src is None:
             return
@@ -304,6 +560,10 @@ class GameController( utils.Controller ):
         self.rubber = None
         self.dst = i
 
+        if self.worker.busy:
+            self.src, self.dst = None, None
+            return
+
         if self.src == self.dst:
             self.src, self.dst = None, None
             return
@@ -327,9 +587,15 @@ class GameController( utils.Controller ):
         self.slider_batch.invalidate()
         self.slider = None
 
-        self.game.launch_fleet( self.src, self.dst, v )
-        
-        self.src, self.dst = None, None # this may not be necessary!        
+        src, dst = self.src, self.dst
+        self.src, self.dst = None, None
+
+        # The game may have changed since the drag began (see seek()): the
+        # planet must still be the human's, and hold the ships
+        if self.worker.busy or not self.game.is_owned_by_human( src ):
+            return
+        v = min( v, self.game.ships_on_planet( src ) )
+        self.recorder.launch_fleet( src, dst, v )
         
     # window event, not button event!
     def on_mouse_drag( self, x, y, dx, dy, but, mod ):
@@ -337,6 +603,14 @@ class GameController( utils.Controller ):
             self.rubber.x2 = x
             self.rubber.y2 = y
 
+    # window event: sort planet table
+    def on_mouse_press( self, x, y, but, mod ):
+        self.table2.on_mouse_press( x, y )
+
+    # window event: scroll planet table
+    def on_mouse_scroll( self, x, y, fx, fy ):
+        self.table2.on_mouse_scroll( x, y, fx, fy )
+
     # window event, not button event!            
     def on_mouse_release( self, x, y, but, mod ):
         if self.rubber:
@@ -344,6 +618,50 @@ class GameController( utils.Controller ):
 
             
     def on_key_press( self, sym, mod ):
+        if sym == pyglet.window.key.F2:
+            if self.frame_stats:
+                self.frame_stats.close()
+                self.frame_stats = None
+            else:
+                self.frame_stats = utils.FrameStats( 10, self.window.height-10 )
+            return
+
+        if sym == pyglet.window.key.F3:
+            self.toggle_timers()
+            return
+
+        if sym == pyglet.window.key.F4:
+            if self.timers:
+                path = time.strftime( "takeover-trace-%Y%m%d-%H%M%S.json" )
+                self.timers.export( path )
+                self.notify( "Trace written to %s" % path )
+            return
+
+        if sym == pyglet.window.key.F5:
+            path = time.strftime( "takeover-replay-%Y%m%d-%H%M%S.tkr" )
+            self.recorder.save( path )
+            self.notify( "Replay written to %s" % path )
+            return
+
+        if sym == pyglet.window.key.A:
+            if self.auto:
+                self.stop_auto()
+            else:
+                self.start_auto()
+            return
+
+        if sym in ( pyglet.window.key.PLUS, pyglet.window.key.EQUAL,
+                    pyglet.window.key.NUM_ADD ):
+            self.change_rate( 1 )
+            return
+
+        if sym in ( pyglet.window.key.MINUS, pyglet.window.key.NUM_SUBTRACT ):
+            self.change_rate( -1 )
+            return
+
+        if self.worker.busy:
+            return
+
         if self.slider:
             if sym == pyglet.window.key.RETURN:
                 self.launch_fleet( self.slider.result )
@@ -351,37 +669,146 @@ class GameController( utils.Controller ):
                 return
         
         if sym == pyglet.window.key.SPACE:
-            alive_players = self.game.propagate( self.table1, self.table2 )
+            self.next_turn()
+            return
 
-            if alive_players == 1:
-                pyglet.clock.unschedule(self.scroll_background)
-                
-                # self.window.pop_handlers() # This pops the frame!
-                # self.window.set_controller( EndController(self.window) )
-
-                self.over = pyglet.text.Label( "Game Over!",
-                                               x=640//2,
-                                               y=self.window.height//2,
-                                               anchor_x = "center",
-                                               color=(0,255,0,255),
-                                               font_size=24 )
+        turn = self.game.schedule.turn
+        if sym == pyglet.window.key.LEFT and turn > 0:
+            self.seek( turn-1 )
+        if sym == pyglet.window.key.RIGHT and turn < self.recorder.log.end:
+            self.seek( turn+1 )
+
+    # Turns are resolved in the background, see collect()
+    def next_turn( self, turns=1, budget=None ):
+        start = time.perf_counter()
+        if self.worker.submit( self.game, turns, budget,
+                               self.timers is not None ):
+            self.submitted = start
+            pyglet.clock.schedule( self.collect )
+
+    # Once the turn is resolved, the game after it replaces the current one
+    def collect( self, dt ):
+        result = self.worker.poll( self.view )
+        if result is None:
+            return
+        pyglet.clock.unschedule( self.collect )
+
+        turn = self.game.schedule.turn
+        self.game = result.game
+        self.recorder.propagate( self.game, result.alive )
+        if self.auto:
+            self.auto[1] += self.game.schedule.turn - turn
+            self.show_auto()
+
+        for dst, is_support in result.arrivals:
+            self.view.show_arrival( self.game.planets[dst], is_support )
+        self.check_over( result.alive )
+
+        if self.timers:
+            self.timers.record( "turn", self.submitted, time.perf_counter() )
+            self.timers.merge( result.events, WORKER_TRACK )
+
+    def start_auto( self ):
+        self.auto = [ time.perf_counter(), 0 ]
+        self.due = 0.0
+        if self.rate:
+            pyglet.clock.schedule_interval( self.auto_turn, 1/self.rate )
+        else:
+            pyglet.clock.schedule( self.auto_turn )
+        self.show_auto()
+
+    def stop_auto( self ):
+        pyglet.clock.unschedule( self.auto_turn )
+        self.auto = None
+
+    def change_rate( self, step ):
+        k = RATES.index( self.rate ) if self.rate in RATES else 0
+        self.rate = RATES[ min( max( k+step, 0 ), len(RATES)-1 ) ]
+        if self.auto:
+            self.stop_auto()
+            self.start_auto()
+
+    # Not while a turn is in flight, or a fleet is being launched (from the
+    # start of the drag). Turns
+    # fall due at the rate; those that couldn't be played in time (slow
+    # frames, slow turns) are made up for in batches, up to a second's worth
+    def auto_turn( self, dt ):
+        if self.rate:
+            self.due = min( self.due + dt*self.rate, self.rate )
+        if self.worker.busy or self.src is not None or self.over:
+            return
+
+        if not self.rate:
+            self.next_turn( 1000, 1/30 )
+        elif self.due >= 1:
+            turns = int( self.due )
+            self.due -= turns
+            self.next_turn( turns )
+
+    def show_auto( self ):
+        start, turns = self.auto
+        elapsed = time.perf_counter() - start
+        rate = "%d/s" % self.rate if self.rate else "max"
+        self.auto_label.text = "Auto: %s (%.1f turns/s)" % (
+            rate, turns/elapsed if elapsed > 0 else 0.0 )
+
+    def seek( self, turn ):
+        start = time.perf_counter()
+        self.game = self.recorder.seek( turn, self.view )
+        if self.timers:
+            self.timers.record( "seek", start, time.perf_counter() )
+        self.check_over( sum( p.is_active() for p in self.game.players ) )
+
+    def notify( self, text, secs=3.0 ):
+        self.notice.text = text
+        pyglet.clock.unschedule( self.clear_notice )
+        pyglet.clock.schedule_once( self.clear_notice, secs )
+
+    def clear_notice( self, dt ):
+        self.notice.text = ""
+
+    def check_over( self, alive_players ):
+        if alive_players == 1 and not self.over:
+            pyglet.clock.unschedule( self.background.scroll )
+
+            # self.window.pop_handlers() # This pops the frame!
+            # self.window.set_controller( EndController(self.window) )
+
+            self.over = pyglet.text.Label( "Game Over!",
+                                           x=640//2,
+                                           y=self.window.height//2,
+                                           anchor_x = "center",
+                                           color=(0,255,0,255),
+                                           font_size=24 )
+
+        # Back from the end of the game (see seek)
+        if alive_players > 1 and self.over:
+            pyglet.clock.schedule_interval( self.background.scroll, 1/60. )
+            self.over = None
                 
-    def scroll_background( self, dt ):
-        self.seam = ( self.bg.height + self.seam - 10*dt )%self.bg.height
+    def toggle_timers( self ):
+        if self.timers:
+            self.timers.restore()
+            self.timers, self.timers_overlay = None, None
+            return
 
-        self.upp.image = self.bg.get_region( 0, self.seam, self.bg.width,
-                                             self.bg.height - self.seam )
-        self.low.image = self.bg.get_region( 0, 0, self.bg.width, self.seam )
-        self.low.y = self.bg.height - self.seam
+        # The phases of a turn are timed by the worker (see next_turn());
+        # seeking, which replays turns here, as a whole (see seek())
+        self.timers = load( "timers" ).Timers()
+        self.timers.instrument( utils.TextTable, "set_rows", "table.set_rows" )
+        self.timers.instrument( utils.ScrollingTable, "refresh",
+                                "table.refresh" )
+        self.timers_overlay = utils.TimersOverlay( self.timers, 10,
+                                                   self.window.height-60 )
 
-        
     def draw( self ):
+        if self.frame_stats:
+            self.frame_stats.begin()
+        if self.timers:
+            start = time.perf_counter()
+
         self.window.clear()
-        pyglet.shapes.Rectangle( self.bg.width+1, 0, 
-                                 self.window.width-self.bg.width-1,
-                                 self.window.height,
-                                 color=(223,224,228) ).draw()        
-        self.metal.draw()
+        self.panel.draw()
         
         self.table1.draw()
         self.table2.draw()
@@ -394,6 +821,22 @@ class GameController( utils.Controller ):
         if self.over:
             self.over.draw()
 
+        if self.worker.busy:
+            self.resolving.draw()
+
+        if self.auto:
+            self.auto_label.draw()
+
+        if self.notice.text:
+            self.notice.draw()
+
+        if self.timers:
+            self.timers.record( "draw", start, time.perf_counter() )
+            self.timers_overlay.draw()
+
+        if self.frame_stats:
+            self.frame_stats.end()
+
 
 # Unused...            
 class EndController( utils.Controller ):
@@ -416,14 +859,41 @@ class EndController( utils.Controller ):
             
 # -----
 
-def main():
+# --ai NAME gives all opponents the strategy NAME; --ai N=NAME only AI<N>
+def main( argv=None ):
+    parser = argparse.ArgumentParser( prog="takeover" )
+    parser.add_argument( "--ai", action="append", default=[],
+                         metavar="[N=]NAME",
+                         help="opponents' strategy: %s" %
+                         ", ".join( strategies.available() ) )
+    parser.add_argument( "--autoplay", type=int, choices=RATES,
+                         default=None, metavar="TPS",
+                         help="start with auto-play on, at that many turns "
+                         "per sec (0: as fast as possible)" )
+    parser.add_argument( "--autopilot", action="store_true",
+                         help="the AI plays for the human as well" )
+    args = parser.parse_args( argv )
+
+    ai, overrides = strategies.BATCHED, {}
+    for arg in args.ai:
+        idx, _, name = arg.rpartition( "=" )
+        if name not in strategies.available():
+            parser.error( "unknown strategy: %s" % name )
+        if idx and not idx.isdigit():
+            parser.error( "not an opponent's index: %s" % idx )
+        if idx:
+            overrides[ int( idx ) ] = name
+        else:
+            ai = name
+
     # NOTE:
     # The resources "module" MUST have an __init__.py file (even if empty)
     # for the resource lookup logic to work!
     pyglet.resource.path = [ "resources", "@takeover.resources" ]
 
     win = utils.MainWindow( width=960, height=640, caption="TakeOver" )
-    win.set_controller( SplashController(win) )
+    win.set_controller( SplashController(win, ai, overrides,
+                                         args.autoplay, args.autopilot) )
     # win.set_controller( GameController(win,1,1) )
 
     pyglet.app.run()
@@ -0,0 +1,100 @@
+
+import functools
+import json
+import time
+
+# Lightweight timers for the phases of a turn (or of a frame), for finding
+# out where the time goes, without an external profiler.
+#
+# Methods are timed by replacing them, on their class, with a timing
+# wrapper (instrument()); restore() puts the originals back. As long as
+# nothing is instrumented, there is no cost at all. Other code can be
+# timed by calling record() explicitly.
+#
+# Every call is kept as an event (the most recent ones only), and can be
+# exported in the Chrome trace format: open the file in chrome://tracing
+# or https://ui.perfetto.dev. Calls within calls show up nested. Events
+# recorded elsewhere (by another process: perf_counter() is system-wide)
+# can be merged in on a track of their own, see merge().
+#
+# Nothing in here knows about pyglet: see utils.TimersOverlay for display.
+
+class Timers:
+    def __init__( self, capacity=100000 ):
+        self.capacity = capacity
+        self.events = []          # ( name, start, end, track ), in secs
+        self.stats = {}           # name -> [ count, total, max, last ]
+        self.patched = []         # ( cls, attr, original )
+
+        self.t0 = time.perf_counter()
+
+    def record( self, name, start, end, track=0 ):
+        if len( self.events ) >= self.capacity:
+            del self.events[ :self.capacity//2 ]
+        self.events.append( ( name, start, end, track ) )
+
+        dt = end - start
+        s = self.stats.get( name )
+        if s is None:
+            self.stats[ name ] = [ 1, dt, dt, dt ]
+        else:
+            s[0] += 1
+            s[1] += dt
+            if dt > s[2]: s[2] = dt
+            s[3] = dt
+
+    # Returns a function that times each call of fn under the given name
+    # (if given, only calls for which when( first argument ) is true)
+    def timed( self, fn, name, when=None ):
+        record, clock = self.record, time.perf_counter
+
+        @functools.wraps( fn )
+        def wrapper( *args, **kwargs ):
+            if when is not None and not when( args[0] ):
+                return fn( *args, **kwargs )
+            start = clock()
+            try:
+                return fn( *args, **kwargs )
+            finally:
+                record( name, start, clock() )
+        return wrapper
+
+    # Time all calls of cls.attr (for all instances, also of subclasses;
+    # or only those that when( instance ) selects)
+    def instrument( self, cls, attr, name=None, when=None ):
+        original = cls.__dict__[ attr ]
+        name = name or "%s.%s" % ( cls.__name__, attr )
+
+        setattr( cls, attr, self.timed( original, name, when ) )
+        self.patched.append( ( cls, attr, original ) )
+
+    def restore( self ):
+        while self.patched:
+            cls, attr, original = self.patched.pop()
+            setattr( cls, attr, original )
+
+    # Events of another Timers object, on the given track
+    def merge( self, events, track ):
+        for name, start, end, _ in events:
+            self.record( name, start, end, track )
+
+    # One line per name: calls, mean, max, last (in millisecs)
+    def summary( self ):
+        lines = []
+        for name, ( n, total, mx, last ) in sorted( self.stats.items() ):
+            lines.append( "%-20s %6d %7.2f %7.2f %7.2f" %
+                          ( name, n, 1000*total/n, 1000*mx, 1000*last ) )
+        return lines
+
+    # Chrome trace format: complete ("X") events, times in microsecs
+    def export( self, path ):
+        events = []
+        for name, start, end, track in self.events:
+            events.append( { "name": name, "cat": "takeover", "ph": "X",
+                             "ts": 1e6*( start - self.t0 ),
+                             "dur": 1e6*( end - start ),
+                             "pid": 0, "tid": track } )
+
+        with open( path, "w" ) as f:
+            json.dump( { "traceEvents": events,
+                         "displayTimeUnit": "ms" }, f )
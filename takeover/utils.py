@@ -1,4 +1,7 @@
 
+import time
+import tracemalloc
+
 import pyglet
 
 # Usage:
@@ -38,7 +41,7 @@ class Controller:
     def on_mouse_press( self, x, y, but, mod): pass
     def on_mouse_release( self, x, y, but, mod): pass
     def on_mouse_drag(self, x, y, dx, dy, but, mod): pass
-    # def on_mouse_scroll(x, y, fx, fy): pass
+    def on_mouse_scroll(self, x, y, fx, fy): pass
                         
     # Text evts
     def on_text(self, text): pass
@@ -281,6 +284,238 @@ class LabeledSlider( pyglet.gui.Slider ):
 LabeledSlider.register_event_type( "on_up" )
         
 
+# Images from pyglet.resource, packed into a common set of texture atlases
+# (a TextureBin), so that sprites using any of them share one texture, and
+# can be drawn together. (pyglet.resource packs images into atlases, too,
+# but sorts them into separate bins by size.) Images larger than an atlas
+# can't be added; load those through pyglet.resource instead.
+class Atlas:
+    def __init__( self, width=2048, height=2048, border=1 ):
+        self.bin = pyglet.image.atlas.TextureBin( width, height )
+        self.border = border
+        self.images = {}
+
+    def image( self, name ):
+        if name not in self.images:
+            with pyglet.resource.file( name ) as f:
+                img = pyglet.image.load( name, file=f )
+            self.images[name] = self.bin.add( img, self.border )
+        return self.images[name]
+
+    # Number of textures (atlases) in use
+    def textures( self ):
+        return len( self.bin.atlases )
+
+
+# Loads things (images, texts, modules, ...) ahead of time, a few at a
+# time, from the pyglet clock: while, say, a splash screen is shown.
+# Each task is a function without arguments; its result is kept under the
+# given key. Tasks run in the order in which they were added; in each
+# clock tick, tasks are run until the time budget (in secs) is used up.
+# Asking for a result that is not yet loaded loads it (and all tasks
+# before it) right away.
+class Preloader:
+    def __init__( self, budget=0.005 ):
+        self.budget = budget
+        self.tasks = []           # ( key, fct ), not yet run
+        self.items = {}
+
+    def add( self, key, fct ):
+        self.tasks.append( ( key, fct ) )
+
+    def start( self ):
+        pyglet.clock.schedule_once( self.step, 0 )
+
+    def step( self, dt ):
+        stop = time.perf_counter() + self.budget
+        while self.tasks and time.perf_counter() < stop:
+            self.run_next()
+
+        if self.tasks:
+            pyglet.clock.schedule_once( self.step, 0 )
+
+    def run_next( self ):
+        key, fct = self.tasks.pop( 0 )
+        self.items[ key ] = fct()
+
+    def done( self ):
+        return not self.tasks
+
+    # Run all remaining tasks now
+    def finish( self ):
+        pyglet.clock.unschedule( self.step )
+        while self.tasks:
+            self.run_next()
+
+    def __getitem__( self, key ):
+        while key not in self.items and self.tasks:
+            self.run_next()
+        return self.items[ key ]
+
+
+# A texture that scrolls vertically (and wraps around), drawn as a single
+# sprite. The texture repeats in y, and the shader adds the current offset
+# to the texture coordinates: scrolling sets one uniform, nothing else.
+# The texture must be a texture of its own (pyglet.resource.texture()),
+# not a region of an atlas.
+scroll_fragment_source = """#version 150 core
+    in vec4 vertex_colors;
+    in vec3 texture_coords;
+    out vec4 final_colors;
+
+    uniform sampler2D sprite_texture;
+    uniform float offset;
+
+    void main()
+    {
+        vec2 st = vec2( texture_coords.x, texture_coords.y + offset );
+        final_colors = texture( sprite_texture, st ) * vertex_colors;
+    }
+"""
+
+class ScrollingBackground:
+    def __init__( self, texture, speed, x=0, y=0, batch=None, group=None ):
+        self.texture = texture
+        self.speed = speed        # pixels per sec; positive: downwards
+        self.offset = 0.0         # fraction of the texture height
+
+        pyglet.gl.glBindTexture( texture.target, texture.id )
+        pyglet.gl.glTexParameteri( texture.target,
+                                   pyglet.gl.GL_TEXTURE_WRAP_T,
+                                   pyglet.gl.GL_REPEAT )
+
+        ctx = pyglet.gl.current_context
+        self.program = ctx.create_program(
+            ( pyglet.sprite.vertex_source, "vertex" ),
+            ( scroll_fragment_source, "fragment" ) )
+        self.program[ "offset" ] = self.offset
+
+        self.sprite = pyglet.sprite.Sprite( texture, x=x, y=y, batch=batch,
+                                            group=group, program=self.program )
+
+    # Use as clock callback
+    def scroll( self, dt ):
+        self.offset = ( self.offset - self.speed*dt/self.texture.height )%1.0
+        self.program[ "offset" ] = self.offset
+
+    def draw( self ):
+        self.sprite.draw()
+
+
+# Frame rate, frame time (time spent in draw), and memory allocated by
+# Python while drawing (the peak above the level at the start of the
+# frame, as seen by tracemalloc), averaged and shown about twice a second.
+# Call begin() and end() around the drawing code; end() draws the overlay.
+# Tracing memory slows things down: it is on only while the overlay exists.
+class FrameStats:
+    def __init__( self, x, y, interval=0.5 ):
+        self.label = pyglet.text.Label( "", x=x, y=y,
+                                        anchor_x="left", anchor_y="top",
+                                        color=(0,255,0,255), font_size=9,
+                                        multiline=True, width=200 )
+        self.interval = interval
+
+        self.frames, self.busy, self.allocated = 0, 0.0, 0
+        self.shown = time.perf_counter()
+
+        tracemalloc.start()
+
+    def close( self ):
+        tracemalloc.stop()
+
+    def begin( self ):
+        self.t0 = time.perf_counter()
+        tracemalloc.reset_peak()
+        self.m0 = tracemalloc.get_traced_memory()[0]
+
+    def end( self ):
+        t1 = time.perf_counter()
+        peak = tracemalloc.get_traced_memory()[1]
+
+        self.frames += 1
+        self.busy += t1 - self.t0
+        self.allocated += peak - self.m0
+
+        if t1 - self.shown >= self.interval:
+            n = self.frames
+            self.label.text = "%.0f fps\n%.2f ms/frame\n%d bytes/frame" % (
+                n/(t1 - self.shown), 1000*self.busy/n, self.allocated//n )
+            self.frames, self.busy, self.allocated = 0, 0.0, 0
+            self.shown = t1
+
+        self.label.draw()
+
+
+# Shows the summary of a timers.Timers object (calls, mean, max, last in
+# millisecs for each timed phase), updated about twice a second.
+class TimersOverlay:
+    def __init__( self, timers, x, y, interval=0.5 ):
+        self.timers = timers
+        self.label = pyglet.text.Label( "", x=x, y=y,
+                                        anchor_x="left", anchor_y="top",
+                                        font_name="Courier New",
+                                        color=(0,255,0,255), font_size=8,
+                                        multiline=True, width=400 )
+        self.interval = interval
+        self.shown = 0.0
+
+    def draw( self ):
+        now = time.perf_counter()
+        if now - self.shown >= self.interval:
+            hdr = "%-20s %6s %7s %7s %7s" % ( "ms", "calls",
+                                              "mean", "max", "last" )
+            self.label.text = "\n".join( [ hdr ] + self.timers.summary() )
+            self.shown = now
+
+        self.label.draw()
+
+
+# A pool of sprites of one kind (image, batch, group), so that sprites need
+# not be created and deleted (along with their vertex lists) all the time.
+# Released sprites are hidden, and handed out again by acquire().
+# For (non-looping) animations, acquire() restarts the animation, and the
+# sprite releases itself when the animation ends.
+class SpritePool:
+    def __init__( self, img, batch=None, group=None ):
+        self.img = img
+        self.batch, self.group = batch, group
+        self.is_animation = isinstance( img, pyglet.image.Animation )
+
+        self.free = []
+        self.created = 0          # size of the pool
+        self.acquired = 0         # all requests; reused: acquired - created
+
+    def acquire( self, x=0, y=0, rotation=0 ):
+        self.acquired += 1
+
+        if self.free:
+            sprite = self.free.pop()
+            if self.is_animation:
+                sprite.image = self.img   # back to the first frame
+            sprite.update( x=x, y=y, rotation=rotation )
+            sprite.visible = True
+            return sprite
+
+        sprite = pyglet.sprite.Sprite( self.img, x=x, y=y,
+                                       batch=self.batch, group=self.group )
+        sprite.rotation = rotation
+        self.created += 1
+
+        if self.is_animation:
+            sprite.on_animation_end = lambda: self.release( sprite )
+        return sprite
+
+    def release( self, sprite ):
+        sprite.visible = False
+        self.free.append( sprite )
+
+    # size, in use, hit rate (fraction of requests served by reuse)
+    def stats( self ):
+        hits = self.acquired - self.created
+        return ( self.created, self.created - len(self.free),
+                 hits/self.acquired if self.acquired else 0.0 )
+
+
 # A block of widgets that can be translated as a whole by setting the coords
 # of the block's lower-left corner.
 # It is assumed that all widgets have a position relative to (0,0); they will
@@ -320,6 +555,10 @@ class Layout:
 # or fractional/percentage col widths. This is currently NOT implemented.
 #
 # Anchor: "left", "center", "right"; "bottom", "center", "top", "baseline"
+#
+# The current text of each cell is cached: setting a cell to the text it
+# already shows does not touch the label (every change of a label's text
+# makes pyglet lay it out again).
 class TextTable():
     def __init__( self, lines, linehgt, colspec,
                   background=(220,220,220), fonts=None, fontsize=None ):
@@ -331,10 +570,13 @@ class TextTable():
         self.height = lines*linehgt
 
         self.cols = len(colspec)
+        self.colspec = colspec
+        self.linehgt = linehgt
 
         self.highlighted = None
         
         self.labels = []
+        self.texts = []
         for i in range(lines):
             pos = 0
             for j in range(self.cols):
@@ -346,6 +588,7 @@ class TextTable():
                                          batch=self.batch )
                 pos += colspec[j]
                 self.labels.append(lab)
+                self.texts.append(lab.text)
 
         self.bgs = []
         for i in range(lines):
@@ -385,13 +628,27 @@ class TextTable():
 
     # row is top->down, col is left->right, both zero indexed!
     def set_text( self, row, col, text ):
-        self.labels[ row*self.cols + col ].text = text
+        k = row*self.cols + col
+
+        if self.texts[k] != text:
+            self.texts[k] = text
+            self.labels[k].text = text
+
+    # Values for the cells of a row, starting at the left. Not strings? Fine.
+    def set_row( self, row, values ):
+        for col, v in enumerate( values ):
+            self.set_text( row, col, str( v ) )
+
+    # Values for consecutive rows, starting at the given one
+    def set_rows( self, row, rows ):
+        for i, values in enumerate( rows ):
+            self.set_row( row+i, values )
     
     def set_attr( self, row, col, text=None,
                   color=(0,0,0,255), bold=False, italic=False, size=None ):
         k = row*self.cols + col
         
-        if text is not None: self.labels[k].text = text
+        if text is not None: self.set_text( row, col, text )
         self.labels[k].color = color
         self.labels[k].bold = bold
         self.labels[k].italic = italic
@@ -401,7 +658,7 @@ class TextTable():
     def set_sprite( self, row, col, sprite ):
         k = row*self.cols + col
 
-        self.labels[k].text = ""
+        self.set_text( row, col, "" )
         
         sprite.x = self.labels[k].x
         sprite.y = self.labels[k].y
@@ -421,12 +678,131 @@ class TextTable():
             self.bgs[row].color = self.highlighted[row]
             self.highlighted[row] = None
         
+    # Is point (x, y) inside the table? If so, which row and col?
+    def hit( self, x, y ):
+        if not ( self.x <= x < self.x+self.width and
+                 self.y <= y < self.y+self.height ):
+            return None
+
+        row = len(self.bgs) - 1 - int( (y - self.y)//self.linehgt )
+        col, right = 0, self.x + self.colspec[0]
+        while x >= right and col < self.cols-1:
+            col += 1
+            right += self.colspec[col]
+        return row, col
+
     def draw( self ):
 #        self.bg = pyglet.shapes.Rectangle( self.x, self.y,
 #                                           self.width, self.height,
 #                                           color=(220,220,220) ).draw()        
         
         self.batch.draw()
+
+
+# A TextTable for more rows than fit on screen: lines rows of data (row 0
+# is the header), of which only a window of visible rows is shown. Labels
+# exist for the visible rows only; they are reused as the window scrolls,
+# or when the rows are sorted.
+#
+# The interface is the one of TextTable, in terms of data rows. Exceptions:
+# set_attr() only applies to the header; set_sprite() is not supported.
+#
+# Clicking on a header cell sorts by that column; clicking again reverses.
+# Forward on_mouse_press() and on_mouse_scroll() from the window to use this.
+class ScrollingTable( TextTable ):
+    def __init__( self, lines, visible, linehgt, colspec, **kwargs ):
+        visible = min( visible, lines-1 )
+        super().__init__( 1+visible, linehgt, colspec, **kwargs )
+
+        self.visible = visible
+        self.data = [ [""]*self.cols for _ in range(lines) ]
+        self.order = list( range( 1, lines ) )  # data rows, as displayed
+        self.top = 0                            # first displayed position
+        self.marked = set()                     # highlighted data rows
+
+        self.sort_col, self.reverse = None, False
+        self.colors = [ bg.color for bg in self.bgs ]
+        self.dirty = True
+
+    def set_text( self, row, col, text ):
+        if row == 0:
+            super().set_text( row, col, text )
+        elif self.data[row][col] != text:
+            self.data[row][col] = text
+            self.dirty = True
+
+    def set_row( self, row, values ):
+        values = [ str( v ) for v in values ]
+        if self.data[row] != values:
+            self.data[row] = values
+            self.dirty = True
+
+    def set_attr( self, row, col, **kwargs ):
+        if row == 0:
+            super().set_attr( row, col, **kwargs )
+
+    def highlight( self, row ):
+        self.marked ^= { row }
+        self.dirty = True
+
+    # Move window by that many rows (positive: down)
+    def scroll( self, lines ):
+        top = max( 0, min( self.top + lines, len(self.order) - self.visible ) )
+        if top != self.top:
+            self.top = top
+            self.dirty = True
+
+    def sort( self, col ):
+        if self.sort_col == col:
+            self.reverse = not self.reverse
+        else:
+            self.sort_col, self.reverse = col, False
+        self.dirty = True
+
+    def on_mouse_press( self, x, y, but=None, mod=None ):
+        cell = self.hit( x, y )
+        if cell is not None and cell[0] == 0:
+            self.sort( cell[1] )
+            return True
+
+    def on_mouse_scroll( self, x, y, fx, fy ):
+        if self.hit( x, y ) is not None:
+            self.scroll( -int( fy ) )
+            return True
+
+    # Numbers sort as numbers, everything else as text (after numbers)
+    @staticmethod
+    def sort_key( text ):
+        try:
+            return ( 0, float( text ), "" )
+        except ValueError:
+            return ( 1, 0.0, text.strip().lower() )
+
+    # Copy the visible window of the data into the labels
+    def refresh( self ):
+        if self.sort_col is not None:
+            col, key = self.sort_col, self.sort_key
+            self.order.sort( key=lambda r: key( self.data[r][col] ),
+                             reverse=self.reverse )
+
+        for i in range( self.visible ):
+            k = self.top + i
+            row = self.order[k] if k < len(self.order) else None
+
+            for col in range( self.cols ):
+                text = self.data[row][col] if row is not None else ""
+                super().set_text( 1+i, col, text )
+
+            color = (255,230,0) if row in self.marked else self.colors[1+i]
+            if self.bgs[1+i].color != color:
+                self.bgs[1+i].color = color
+
+        self.dirty = False
+
+    def draw( self ):
+        if self.dirty:
+            self.refresh()
+        super().draw()
         
 
 if __name__ == "__main__":
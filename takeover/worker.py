@@ -0,0 +1,189 @@
+
+import concurrent.futures
+import multiprocessing
+import time
+
+# if run as a script, pull from local directory
+# otherwise (if run as module), pull from package
+if __package__:
+    from . import gamelogic
+    from . import snapshot
+    from . import timers
+else:
+    import gamelogic
+    import snapshot
+    import timers
+
+# Resolves turns in the background, so that the UI stays responsive while
+# the AIs move and battles are fought.
+#
+# The game is sent to a worker process as a snapshot (see snapshot); the
+# worker restores it, plays the turn, and sends back the state after the
+# turn, again as a snapshot, together with the number of players still
+# alive and the arrivals of the turn (the only events the UI can't get
+# from the new state), as ( dst, is_support ), by planet index. That is
+# the whole difference the turn made; the UI restores it, with its own
+# observer, on its own thread, when the result is in (see poll()). The
+# restored game plays on exactly as the original would have, so the
+# result is the same as that of game.propagate().
+#
+# The worker keeps its game for the next turn. Until then, the UI only
+# changes its copy by launching the human's fleets: so if the game
+# submitted next is the last result, only those launches are sent, and
+# the worker makes them in its game (as the recorder does in a replay).
+# Any other game (the first, or one from seeking) is sent as a snapshot.
+# Results are numbered, to make sure the two games match.
+#
+# Several turns can be resolved in one go (for auto-play, see takeover):
+# up to a number of turns, or for up to a time budget, or until the game
+# is over. Only the state after the last of them comes back, and only the
+# arrivals of the last one.
+#
+# On request, the phases of the turns (propagate, make_move, fight) are
+# timed in the worker, and the events come back with the result, to be
+# merged into the UI's timers (see timers.Timers.merge()). Only the game's
+# own are timed, not those of copies a strategy plays out (see lookahead).
+#
+# Only one submission can be in flight: submit() refuses another one,
+# until the result has been collected. Meanwhile, the game must not be
+# changed.
+#
+# A process, not a thread: a turn is pure Python, and a worker thread would
+# hold the GIL against the UI, which gives it up on every OpenGL call, and
+# has to wait for it to come back each time. The process is spawned (not
+# forked from the UI): it starts afresh, and re-imports the main module as
+# __mp_main__ (the UI's, under python -m takeover, pyglet included), but
+# doesn't run it. Entry points must be guarded by __name__ == "__main__",
+# and imports must not depend on it (see takeover).
+
+class WorkerError( Exception ):
+    pass
+
+
+class Arrivals( gamelogic.Observer ):
+    def __init__( self ):
+        self.fleets = []          # ( dst, is_support )
+        self.last = []            # those of the last turn
+
+    def turn_finished( self, game ):
+        self.last, self.fleets = self.fleets, []
+
+    def fleet_arrived( self, fleet, is_support ):
+        self.fleets.append( ( fleet.dst.idx, is_support ) )
+
+
+# Run in the worker process. ready() does nothing, but the process has to
+# start, and import the game logic, to run it
+def ready():
+    return True
+
+# The worker's game, and the number of the result it was sent back as
+current = None
+
+# The game is given as a snapshot (data), or else as the launches made in
+# the last result (by number: key)
+def resolve( data, launches, key, turns, budget, timed=False ):
+    global current
+    deadline = time.perf_counter() + budget if budget else None
+    if data is not None:
+        game = snapshot.loads( data, Arrivals() )
+    else:
+        if current is None or current[0] != key:
+            raise WorkerError( "Worker out of sync: result %d expected" %
+                               key )
+        game = current[1]
+        for src, dst, ships in launches:
+            game.launch_fleet( src, dst, ships )
+    current = None
+
+    phases = timers.Timers()
+    if timed:
+        mine = lambda obj: obj.schedule is game.schedule
+        phases.instrument( gamelogic.Player, "make_move", "make_move", mine )
+        phases.instrument( gamelogic.Fleet, "fight", "fight", mine )
+    try:
+        for _ in range( turns ):
+            start = time.perf_counter()
+            alive = game.propagate()
+            if timed:
+                phases.record( "propagate", start, time.perf_counter() )
+            if alive <= 1:
+                break
+            if deadline and time.perf_counter() > deadline:
+                break
+    finally:
+        phases.restore()
+
+    current = ( key+1, game )
+    return snapshot.dumps( game ), alive, game.observer.last, phases.events
+
+
+class Result:
+    def __init__( self, game, alive, arrivals, events ):
+        self.game = game
+        self.alive = alive
+        self.arrivals = arrivals
+        self.events = events      # see timers.Timers.merge()
+
+
+class TurnWorker:
+    def __init__( self ):
+        context = multiprocessing.get_context( "spawn" )
+        self.pool = concurrent.futures.ProcessPoolExecutor( 1, context )
+        self.started = self.pool.submit( ready )   # now, not on the 1st turn
+        self.future = None
+
+        self.key = 0              # number of the last result
+        self.last = None          # its game, and its schedule seq then
+        self.seq = 0
+
+    @property
+    def busy( self ):
+        return self.future is not None
+
+    # Starts resolving the game's turn (or turns, see above: budget in secs;
+    # timed: with events for the phases); False if turns are in flight
+    # already
+    def submit( self, game, turns=1, budget=None, timed=False ):
+        if self.busy:
+            return False
+
+        self.game = game
+        launches = self.launches( game )
+        data = snapshot.dumps( game ) if launches is None else None
+        self.future = self.pool.submit( resolve, data, launches, self.key,
+                                        turns, budget, timed )
+        return True
+
+    # The launches made in the game since it came back as the last result,
+    # as ( src, dst, ships ); None if it isn't that game, or has changed
+    # otherwise
+    def launches( self, game ):
+        if game is not self.last:
+            return None
+
+        human = game.players[0]
+        fleets = sorted( entry[1:] for entry in game.schedule.heap
+                         if entry[1] >= self.seq )
+        if any( f.owner is not human for _, f in fleets ):
+            return None
+        return [ ( f.src.idx, f.dst.idx, f.ships ) for _, f in fleets ]
+
+    # The result, once the turn is resolved (None until then), restored
+    # with the given observer; it shares the neighbor index of the game
+    # submitted. Exceptions in the worker are raised here.
+    def poll( self, observer=None ):
+        if self.future is None or not self.future.done():
+            return None
+
+        future, self.future = self.future, None
+        self.last = None
+        data, alive, arrivals, events = future.result()
+        game = snapshot.loads( data, observer, self.game.distances )
+
+        self.key += 1
+        self.last, self.seq = game, game.schedule.seq
+        return Result( game, alive, arrivals, events )
+
+    def close( self ):
+        self.pool.shutdown( wait=True )